@@ -0,0 +1,165 @@
+"""
+A thread-safe front end to Session for serving several clients at once.
+
+Every call returns a Result right away (use .get() to wait for it),
+and the parsing itself runs on a worker pool.
+
+Each root is parsed as a request of its own, and a request for several
+roots waits for all of them. So requests that share a root while it's
+still being parsed share that parse, whatever other roots they ask for,
+and identical requests share their whole result. Rewrites of the same
+file, including ones it includes, are serialised.
+"""
+
+from multiprocessing import TimeoutError
+from multiprocessing.pool import ThreadPool
+import sys
+import threading
+
+from script import Session, insert_chunks, print_chunks, render_chunks
+
+
+class Result(object):
+	"""
+	Like the pool's AsyncResult, but any number of threads can wait on it.
+	(AsyncResult only wakes one waiter.)
+	"""
+	def __init__(self):
+		self.event = threading.Event()
+		self.value = None
+		self.exc_info = None
+		self.lock = threading.Lock()
+		self.callbacks = []
+
+	def ready(self):
+		return self.event.is_set()
+
+	def set(self):
+		with self.lock:
+			self.event.set()
+			callbacks, self.callbacks = self.callbacks, []
+		for callback in callbacks:
+			callback(self)
+
+	def add_callback(self, callback):
+		"""Call callback(self) once the result is ready (now, if it already is)."""
+		with self.lock:
+			if not self.event.is_set():
+				self.callbacks += [callback]
+				return
+		callback(self)
+
+	def get(self, timeout=None):
+		if not self.event.wait(timeout):
+			raise TimeoutError
+		if self.exc_info:
+			raise self.exc_info[0], self.exc_info[1], self.exc_info[2]
+		return self.value
+
+
+class AsyncSession(object):
+	def __init__(self, session, workers=4):
+		if isinstance(session, basestring):
+			session = Session(session)
+		self.session = session
+		self.pool = ThreadPool(workers)
+		self.session_lock = threading.RLock()
+		self.lock = threading.Lock()
+		self.in_flight = {}
+		self.file_locks = {}
+
+	def submit(self, key, function, *args, **kwargs):
+		"""
+		Run function(*args) on the pool, unless an identical request is already running.
+		If after is given, it only starts once those results are ready, and fails
+		with the first of them that failed. Nothing waits on the pool meanwhile.
+		"""
+		after = kwargs.get('after', [])
+		with self.lock:
+			if key in self.in_flight:
+				return self.in_flight[key]
+			result = Result()
+			self.in_flight[key] = result
+		def run():
+			try:
+				for other in after:
+					other.get()
+				result.value = function(*args)
+			except:
+				result.exc_info = sys.exc_info()
+			with self.lock:
+				del self.in_flight[key]
+			result.set()
+		remaining = [len(after)]
+		def done(other):
+			with self.lock:
+				remaining[0] -= 1
+				start = not remaining[0]
+			if start:
+				self.pool.apply_async(run)
+		if after:
+			for other in after:
+				other.add_callback(done)
+		else:
+			self.pool.apply_async(run)
+		return result
+
+	def file_lock(self, path):
+		with self.lock:
+			return self.file_locks.setdefault(path, threading.Lock())
+
+	def _parse(self, root):
+		with self.session_lock:
+			self.session.parse(*root)
+
+	def parse_roots(self, roots):
+		"""A Result for each root, shared with any other request parsing it."""
+		return [self.submit(('parse', root), self._parse, root) for root in roots]
+
+	def _get_recursive_all(self, roots):
+		# The session's chunks are shared and relabelled by later queries, so hand out a rendering of them.
+		with self.session_lock:
+			return render_chunks(self.session.get_recursive_all(roots))
+
+	def _print_recursive_all(self, roots):
+		# Labels are renamed by every query, so render before another one can resolve.
+		with self.session_lock:
+			return print_chunks(self.session.get_recursive_all(roots))
+
+	def _insert_recursive_all(self, roots, paths):
+		with self.session_lock:
+			chunks = render_chunks(self.session.get_recursive_all(roots))
+		version = self.session.version
+		if paths is None:
+			paths = version['maps_paths']
+		for path in paths:
+			insert_chunks(chunks, path, version, self.session.coverage, self.session.incbins, self.file_lock)
+		with self.session_lock:
+			self.session.reload_labels()
+
+	def get_recursive_all(self, roots):
+		roots = tuple(map(tuple, roots))
+		return self.submit(('get', roots), self._get_recursive_all, roots, after=self.parse_roots(roots))
+
+	def print_recursive_all(self, roots):
+		roots = tuple(map(tuple, roots))
+		return self.submit(('print', roots), self._print_recursive_all, roots, after=self.parse_roots(roots))
+
+	def insert_recursive_all(self, roots, paths=None):
+		roots = tuple(map(tuple, roots))
+		if paths is not None:
+			paths = tuple(paths)
+		return self.submit(('insert', roots, paths), self._insert_recursive_all, roots, paths, after=self.parse_roots(roots))
+
+	def get_recursive(self, class_, address):
+		return self.get_recursive_all([(class_, address)])
+
+	def print_recursive(self, class_, address):
+		return self.print_recursive_all([(class_, address)])
+
+	def insert_recursive(self, class_, address, paths=None):
+		return self.insert_recursive_all([(class_, address)], paths)
+
+	def close(self):
+		self.pool.close()
+		self.pool.join()
@@ -256,7 +256,8 @@ if __name__ == '__main__':
 	args = get_args(
 		('--macros', {'action': 'store_true'}),
 		('-i', {'dest': 'insert', 'action': 'store_true'}),
-		('addresses', {'nargs': '*', 'type': lambda x: int(x, 16)})
+		('addresses', {'nargs': '*', 'type': lambda x: int(x, 16)}),
+		progress_argument,
 	)
 	if args.macros:
 		print get_script_macros(battle_ai_commands)
@@ -265,8 +266,9 @@ if __name__ == '__main__':
 			cls, addresses = BattleAIScript, args.addresses
 		else:
 			cls, addresses = BattleAIs, [BattleAIs.address]
+		progress = get_progress(args.progress)
 		for address in addresses:
 			if args.insert:
-				insert_recursive(cls, address)
+				insert_recursive(cls, address, progress=progress)
 			else:
 				print print_recursive(cls, address)
@@ -1139,6 +1139,20 @@ battle_script_commands = {
 battle_script_command_classes = make_command_classes(battle_script_commands, 'BattleCommand_')
 
 
+def get_battle_script_roots(items):
+	"""
+	Turn a mix of tables (classes with an address) and bare BattleScript addresses
+	into roots for a single shared parse (see recursive_parse_all).
+	"""
+	roots = []
+	for item in items:
+		if isinstance(item, (int, long)):
+			roots += [(BattleScript, item)]
+		else:
+			roots += [(item, item.address)]
+	return roots
+
+
 
 if __name__ == '__main__':
 	args = get_args(
@@ -1152,14 +1166,13 @@ if __name__ == '__main__':
 		('--macros', {
 			'action': 'store_true',
 		}),
+		progress_argument,
 	)
 	if args.macros:
 		print get_script_macros(battle_script_commands)
-	elif args.insert:
-		for address in args.addresses:
-			address = int(address, 16)
-			insert_recursive(BattleScript, address)
 	else:
-		for address in args.addresses:
-			address = int(address, 16)
-			print print_recursive(BattleScript, address, 'ruby')
+		roots = get_battle_script_roots([int(address, 16) for address in args.addresses])
+		if args.insert:
+			insert_recursive_all(roots, progress=get_progress(args.progress))
+		else:
+			print print_recursive_all(roots, 'ruby')
@@ -0,0 +1,325 @@
+"""
+Keep benchmark results over time, and catch the commits that made things slower.
+
+Each benchmark run is appended to a json lines file, keyed by the git commit it
+was run at (with a + if the tree had changes) and a fingerprint of the machine,
+both as benchmark.py recorded them when it ran.
+Runs of the same commit on the same machine and setup are pooled, so running
+the benchmarks again narrows their confidence intervals.
+
+A commit is a regression when its mean time is more than threshold slower than
+the commit before it, and Welch's t-test says the difference is significant.
+
+	$ python pret-agb/bench_history.py run --repeat 5
+	$ python pret-agb/bench_history.py add bench.json
+	$ python pret-agb/bench_history.py trend --scenario recursive_parse
+	$ python pret-agb/bench_history.py check --threshold 0.05
+"""
+
+from collections import OrderedDict
+import hashlib
+import json
+import math
+import multiprocessing
+import os
+import platform
+import profiling
+import subprocess
+import sys
+import time
+
+
+repo_path = os.path.dirname(os.path.abspath(__file__))
+
+# Two-sided 95% critical values of Student's t, by degrees of freedom.
+t_table = [
+	None, 12.706, 4.303, 3.182, 2.776, 2.571, 2.447, 2.365, 2.306, 2.262, 2.228,
+	2.201, 2.179, 2.160, 2.145, 2.131, 2.120, 2.110, 2.101, 2.093, 2.086,
+	2.080, 2.074, 2.069, 2.064, 2.060, 2.056, 2.052, 2.048, 2.045, 2.042,
+]
+
+def get_t(df):
+	"""The critical t for df degrees of freedom, rounded down to be safe."""
+	if df < 1:
+		return None
+	if df < len(t_table):
+		return t_table[int(df)]
+	if df < 60:
+		return 2.021
+	if df < 120:
+		return 2.000
+	return 1.960
+
+def mean(values):
+	return float(sum(values)) / len(values)
+
+def variance(values):
+	m = mean(values)
+	return sum((value - m) ** 2 for value in values) / (len(values) - 1)
+
+def confidence_interval(samples):
+	"""(mean, low, high), 95%. low and high are None with fewer than two samples."""
+	m = mean(samples)
+	if len(samples) < 2:
+		return m, None, None
+	margin = get_t(len(samples) - 1) * math.sqrt(variance(samples) / len(samples))
+	return m, m - margin, m + margin
+
+def welch(a, b):
+	"""Whether the means of a and b differ significantly (95%), by Welch's t-test."""
+	if len(a) < 2 or len(b) < 2:
+		return False
+	va, vb = variance(a) / len(a), variance(b) / len(b)
+	if not va + vb:
+		return mean(a) != mean(b)
+	t = (mean(b) - mean(a)) / math.sqrt(va + vb)
+	df = (va + vb) ** 2 / ((va ** 2 / (len(a) - 1) if va else 0) + (vb ** 2 / (len(b) - 1) if vb else 0))
+	return abs(t) > get_t(df)
+
+
+def git(*args):
+	try:
+		with open(os.devnull, 'w') as devnull:
+			return subprocess.check_output(('git',) + args, cwd=repo_path, stderr=devnull).strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+def get_commit(rev=None):
+	"""
+	The commit the tree is at, and whether it has uncommitted changes.
+	If rev is given, it's that commit instead, as committed.
+	"""
+	sha = git('rev-parse', '--verify', (rev or 'HEAD') + '^{commit}')
+	if rev and not sha:
+		raise ValueError('no such commit: ' + rev)
+	return {
+		'commit': sha,
+		'dirty': bool(git('status', '--porcelain', '--untracked-files=no')) if not rev else False,
+		'subject': git('log', '-1', '--format=%s', sha) if sha else None,
+		'commit_time': int(git('log', '-1', '--format=%ct', sha)) if sha else None,
+	}
+
+def get_cpu_model():
+	if os.path.exists('/proc/cpuinfo'):
+		for line in open('/proc/cpuinfo'):
+			if line.startswith('model name'):
+				return line.split(':', 1)[1].strip()
+	return platform.processor()
+
+def get_machine():
+	"""What a run's times depend on, other than the code, and a short hash of it."""
+	info = {
+		'node': platform.node(),
+		'system': platform.system(),
+		'arch': platform.machine(),
+		'cpu': get_cpu_model(),
+		'cpus': multiprocessing.cpu_count(),
+		'python': platform.python_version(),
+	}
+	fingerprint = hashlib.sha1(json.dumps(info, sort_keys=True)).hexdigest()[:12]
+	return fingerprint, info
+
+def get_key(record):
+	commit = (record.get('commit') or 'unknown')[:10]
+	return commit + ('+' if record.get('dirty') else '')
+
+def get_setup(record):
+	"""Runs are only comparable on the same version and synthetic project."""
+	options = record.get('options', {})
+	return '{} '.format(record.get('version')) + ' '.join(
+		'{}={}'.format(key, value) for key, value in sorted(options.items()) if value is not None
+	)
+
+
+def get_run_info():
+	"""What benchmark.py records about where and when it ran."""
+	machine, machine_info = get_machine()
+	info = get_commit()
+	info.update({
+		'recorded': time.time(),
+		'host': machine_info['node'],
+		'machine': machine,
+		'machine_info': machine_info,
+	})
+	return info
+
+def make_record(report, rev=None, here=False):
+	"""
+	A history record of a report from benchmark.py. Reports carry the commit and
+	machine they were run on. For older ones that don't, rev names the commit, and
+	here says it was run on this machine.
+	"""
+	record = dict(report)
+	if rev:
+		record.update(get_commit(rev))
+	elif 'commit' not in record:
+		raise ValueError('the report doesn\'t say which commit it was run at; give one with --commit')
+	if 'machine_info' not in record:
+		if not here:
+			raise ValueError('the report doesn\'t say which machine it was run on; use --here if it was this one')
+		machine, machine_info = get_machine()
+		record.update({
+			'host': machine_info['node'],
+			'machine': machine,
+			'machine_info': machine_info,
+		})
+	record.setdefault('recorded', time.time())
+	return record
+
+def append(path, record):
+	with open(path, 'a') as out:
+		out.write(json.dumps(record, sort_keys=True) + '\n')
+
+def read_history(path):
+	if not os.path.exists(path):
+		return []
+	return [json.loads(line) for line in open(path) if line.strip()]
+
+def get_samples(result, field):
+	if field == 'seconds':
+		return result.get('samples') or [result['seconds']]
+	value = result.get(field)
+	return [value] if value is not None else []
+
+def get_series(records, field='seconds', machine=None):
+	"""
+	{(machine, setup): {scenario: [(commit key, subject, samples)]}}, with commits in
+	the order they were first recorded and the samples of all their runs pooled.
+	"""
+	series = OrderedDict()
+	for record in records:
+		if machine and record['machine'] != machine:
+			continue
+		scenarios = series.setdefault((record['machine'], get_setup(record)), OrderedDict())
+		for name, result in sorted(record['scenarios'].items()):
+			commits = scenarios.setdefault(name, OrderedDict())
+			key = get_key(record)
+			subject, samples = commits.get(key, (record.get('subject'), []))
+			commits[key] = (subject, samples + get_samples(result, field))
+	return OrderedDict(
+		(series_key, OrderedDict(
+			(name, [(key, subject, samples) for key, (subject, samples) in commits.items() if samples])
+			for name, commits in scenarios.items()
+		))
+		for series_key, scenarios in series.items()
+	)
+
+def find_regressions(points, threshold=0.1):
+	"""(previous commit, commit, change) wherever a commit is significantly and more than threshold slower than the one before."""
+	regressions = []
+	for (old_key, _, old), (key, subject, new) in zip(points, points[1:]):
+		change = mean(new) / mean(old) - 1 if mean(old) else 0
+		if change > threshold and welch(old, new):
+			regressions += [(old_key, key, change)]
+	return regressions
+
+
+def format_value(value):
+	return '{:.4g}'.format(value) if abs(value) < 10000 else '{:.0f}'.format(value)
+
+def draw_bar(m, low, high, scale, width):
+	position = lambda value: min(width, int(round(value * scale)))
+	bar = [' '] * (width + 1)
+	for i in xrange(position(m)):
+		bar[i] = '#'
+	if low is not None:
+		for i in xrange(position(max(low, 0)), position(high) + 1):
+			if bar[i] == ' ':
+				bar[i] = '-'
+		bar[position(max(low, 0))] = '['
+		bar[position(high)] = ']'
+	return ''.join(bar)
+
+def print_trend(name, points, field='seconds', threshold=0.1, width=40):
+	"""A chart of each commit's mean, with its confidence interval, and regressions marked with !."""
+	stats = [(key, subject) + confidence_interval(samples) + (len(samples),) for key, subject, samples in points]
+	top = max(high if high is not None else m for key, subject, m, low, high, n in stats)
+	scale = width / top if top else 0
+	slower = dict((key, change) for old_key, key, change in find_regressions(points, threshold))
+	lines = ['{} ({}, mean and 95% interval)'.format(name, field)]
+	previous = None
+	for key, subject, m, low, high, n in stats:
+		change = '{:+.1%}'.format(m / previous - 1) if previous else ''
+		margin = '+-' + format_value(high - m) if high is not None else ''
+		lines += ['{} {:<11} {:>10} {:<10} {:>7} n={:<3} |{}| {}'.format(
+			'!' if key in slower else ' ', key, format_value(m), margin, change, n,
+			draw_bar(m, low, high, scale, width), (subject or '')[:40],
+		)]
+		previous = m
+	return '\n'.join(lines)
+
+def print_series_header(series_key, records):
+	machine, setup = series_key
+	info = next(record['machine_info'] for record in records if record['machine'] == machine)
+	return 'machine {} ({}, {}, {} cpus, python {}), {}'.format(
+		machine, info['node'], info['cpu'], info['cpus'], info['python'], setup
+	)
+
+def check(records, threshold=0.1, machine=None):
+	"""Regressions of the latest commit in each series against the commit before it: (series, scenario, old, new, change)."""
+	found = []
+	for series_key, scenarios in get_series(records, machine=machine).items():
+		for name, points in scenarios.items():
+			for old_key, key, change in find_regressions(points[-2:], threshold):
+				found += [(series_key, name, old_key, key, change)]
+	return found
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('command', choices=['run', 'add', 'trend', 'check'])
+	ap.add_argument('files', nargs='*', help='benchmark.py --output files to add')
+	ap.add_argument('--history', default='bench_history.jsonl', help='where results are kept (default: bench_history.jsonl)')
+	ap.add_argument('--commit', help='for add: the commit the files were run at, if they don\'t say')
+	ap.add_argument('--here', action='store_true', help='for add: the files were run on this machine, if they don\'t say')
+	ap.add_argument('--version', default='ruby')
+	ap.add_argument('--scenario', action='append', help='only these scenarios (default: all)')
+	ap.add_argument('--repeat', type=int, default=5)
+	ap.add_argument('--seed', type=int, default=0)
+	ap.add_argument('--maps', type=int, default=64)
+	ap.add_argument('--groups', type=int, default=8)
+	ap.add_argument('--project', help='benchmark this project instead of a synthetic one')
+	ap.add_argument('--field', default='seconds', help='what to chart (default: seconds; also peak_rss_kb, allocated_objects, ...)')
+	ap.add_argument('--all-machines', action='store_true', help='not just this machine')
+	ap.add_argument('--last', type=int, default=20, help='chart this many commits')
+	ap.add_argument('--threshold', type=float, default=0.1, help='how much slower is a regression (default: 0.1)')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	machine = None if args.all_machines else get_machine()[0]
+
+	if args.command == 'run':
+		import benchmark
+		report = benchmark.benchmark(args.version, args.scenario, args.repeat, args.project, seed=args.seed, maps=args.maps, groups=args.groups)
+		append(args.history, make_record(report))
+	elif args.command == 'add':
+		try:
+			records = [make_record(json.load(open(filename)), args.commit, args.here) for filename in args.files]
+		except ValueError as e:
+			ap.error(str(e))
+		for record in records:
+			append(args.history, record)
+
+	records = read_history(args.history)
+	if args.command == 'trend':
+		for series_key, scenarios in get_series(records, args.field, machine).items():
+			print print_series_header(series_key, records)
+			for name, points in scenarios.items():
+				if args.scenario and name not in args.scenario:
+					continue
+				print print_trend(name, points[-args.last:], args.field, args.threshold)
+			print
+	elif args.command in ['run', 'check']:
+		regressions = [
+			item for item in check(records, args.threshold, machine)
+			if not args.scenario or item[1] in args.scenario
+		]
+		for series_key, name, old_key, key, change in regressions:
+			sys.stderr.write('regression: {} {} -> {} {:+.1%} ({})\n'.format(name, old_key, key, change, series_key[1]))
+		if regressions:
+			sys.exit(1)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,320 @@
+"""
+Time the disassembly pipeline on a synthetic rom, so that changes to it can be
+measured anywhere, without a baserom.
+
+Each scenario sets up what it needs and then times one step of the pipeline.
+Every run is in a fresh process with a fresh copy of the project, so steps that
+rewrite files start from the same tree each time, and peak memory is the
+scenario's own.
+
+	$ python pret-agb/benchmark.py --output bench.json
+	$ python pret-agb/benchmark.py --baseline bench.json --threshold 0.1
+"""
+
+import gc
+import json
+from multiprocessing import Pool
+import os
+import platform
+import profiling
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from dump_maps import *
+import bench_history
+import charmap
+import find_files
+import synthetic_rom
+
+scenarios = []
+
+def scenario(name):
+	"""
+	Register a benchmark. The function is called with a set up version, in the
+	project directory, and returns (run, units): run is what gets timed, and
+	units is how much work it does, for a rate.
+	"""
+	def register(function):
+		scenarios.append((name, function))
+		return function
+	return register
+
+def get_scenario(name):
+	return dict(scenarios)[name]
+
+
+def get_map_chunks(version):
+	chunks = flatten_nested_chunks(dump_maps(version))
+	return resolve_labels(chunks, version)
+
+@scenario('value_parse')
+def bench_value_parse(version):
+	rom = version['baserom']
+	addresses = xrange(0, 0x8000, 4)
+	def run():
+		for class_ in (Byte, Word, Int, Pointer):
+			for address in addresses:
+				class_(address, version=version, rom=rom)
+	return run, len(addresses) * 4
+
+@scenario('script_parse')
+def bench_script_parse(version):
+	rom = version['baserom']
+	roots = [
+		(chunk.__class__, chunk.address)
+		for chunk in dump_maps(version)
+		if isinstance(chunk, EventScript)
+	]
+	def run():
+		for class_, address in roots:
+			class_(address, version=version, rom=rom)
+	return run, len(roots)
+
+@scenario('recursive_parse')
+def bench_recursive_parse(version):
+	rom = version['baserom']
+	def run():
+		recursive_parse(MapGroups, version['map_groups_address'], version=version, rom=rom)
+	return run, len(version['map_names'])
+
+@scenario('charmap_decode')
+def bench_charmap_decode(version):
+	strings = [
+		chunk.bytes for chunk in flatten_nested_chunks(dump_maps(version))
+		if isinstance(chunk, String)
+	]
+	decode_charmap = version['charmap']
+	# Map text alone is too little to time, so go over it until there's enough.
+	rounds = max(1, 0x10000 // max(1, sum(map(len, strings))))
+	def run():
+		for i in xrange(rounds):
+			for string in strings:
+				charmap.decode(string, decode_charmap)
+	return run, rounds * sum(map(len, strings))
+
+@scenario('print_chunks')
+def bench_print_chunks(version):
+	chunks = get_map_chunks(version)
+	def run():
+		print_chunks(chunks)
+	return run, len(chunks)
+
+@scenario('insert_chunks')
+def bench_insert_chunks(version):
+	chunks = get_map_chunks(version)
+	def run():
+		for path in version['maps_paths']:
+			insert_chunks(chunks, path, version)
+	return run, len(chunks)
+
+@scenario('find_files')
+def bench_find_files(version):
+	chunks = get_map_chunks(version)
+	for path in version['maps_paths']:
+		insert_chunks(chunks, path, version)
+	def run():
+		find_files.main(version)
+	return run, len(version['map_names'])
+
+
+def make_project(path, version_name='ruby', **options):
+	"""Write a synthetic rom and its .s files to path."""
+	rom, files = synthetic_rom.build(version_name, **options)
+	cwd = os.getcwd()
+	os.chdir(path)
+	try:
+		synthetic_rom.write(rom, files, version_name)
+	finally:
+		os.chdir(cwd)
+
+def get_peak_rss():
+	"""Peak resident memory of this process, in kB."""
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+	if sys.platform == 'darwin':
+		peak //= 1024
+	return peak
+
+def count_objects():
+	"""
+	Count every Object (chunks, labels, pointers...) made from now on, by wrapping Object.__init__.
+	Returns the count, a list of one, and a function that stops counting.
+	"""
+	count = [0]
+	init = Object.__init__.im_func
+	def counted_init(self, *args, **kwargs):
+		count[0] += 1
+		init(self, *args, **kwargs)
+	Object.__init__ = counted_init
+	def stop():
+		Object.__init__ = init
+	return count, stop
+
+def run_once(name, project, version_name):
+	"""
+	Copy the project, set up the scenario in it and time one run.
+	Allocated objects are the Objects made during the run. Retained objects are
+	the gc-tracked objects still alive after it, once garbage is collected, that weren't before it.
+	"""
+	scratch = tempfile.mkdtemp(prefix='pret-agb-bench-')
+	try:
+		path = os.path.join(scratch, 'project')
+		shutil.copytree(project, path)
+		os.chdir(path)
+		version = get_setup_version(version_name)
+		run, units = get_scenario(name)(version)
+		gc.collect()
+		objects = len(gc.get_objects())
+		rss = get_peak_rss()
+		allocated, stop = count_objects()
+		start = time.time()
+		try:
+			run()
+		finally:
+			seconds = time.time() - start
+			stop()
+		peak_rss = get_peak_rss()
+		gc.collect()
+		return {
+			'seconds': seconds,
+			'units': units,
+			'peak_rss_kb': peak_rss,
+			'rss_growth_kb': peak_rss - rss,
+			'allocated_objects': allocated[0],
+			'retained_objects': len(gc.get_objects()) - objects,
+		}
+	finally:
+		shutil.rmtree(scratch)
+
+def median(values):
+	values = sorted(values)
+	middle = len(values) // 2
+	if len(values) % 2:
+		return values[middle]
+	return (values[middle - 1] + values[middle]) / 2.
+
+def summarize(runs):
+	seconds = [run['seconds'] for run in runs]
+	units = runs[0]['units']
+	return {
+		'runs': len(runs),
+		'samples': seconds,
+		'seconds': median(seconds),
+		'min_seconds': min(seconds),
+		'max_seconds': max(seconds),
+		'units': units,
+		'units_per_second': units / median(seconds) if median(seconds) else None,
+		'peak_rss_kb': max(run['peak_rss_kb'] for run in runs),
+		'rss_growth_kb': max(run['rss_growth_kb'] for run in runs),
+		'allocated_objects': int(median([run['allocated_objects'] for run in runs])),
+		'retained_objects': int(median([run['retained_objects'] for run in runs])),
+	}
+
+def run_benchmarks(project, version_name='ruby', names=None, repeat=3, log=sys.stderr):
+	"""
+	Run each named scenario (or all of them) repeat times.
+	Returns {name: summary}, where times are medians and memory is the worst run.
+	"""
+	if names is None:
+		names = [name for name, function in scenarios]
+	results = {}
+	for name in names:
+		runs = []
+		for i in xrange(repeat):
+			# A new process per run, so memory and module state don't carry over.
+			pool = Pool(1)
+			try:
+				runs += [pool.apply(run_once, (name, project, version_name))]
+			finally:
+				pool.close()
+				pool.join()
+		results[name] = summarize(runs)
+		if log:
+			log.write('{}: {:.3f}s (min {:.3f}s), peak {} kB, {} objects made, {} kept\n'.format(
+				name, results[name]['seconds'], results[name]['min_seconds'],
+				results[name]['peak_rss_kb'], results[name]['allocated_objects'], results[name]['retained_objects'],
+			))
+	return results
+
+compared_fields = ['seconds', 'peak_rss_kb']
+
+def compare(results, baseline, threshold=0.1):
+	"""
+	(name, field, old, new, change) for each scenario measure that got worse than
+	baseline by more than threshold (a fraction). Scenarios missing from either are skipped.
+	"""
+	regressions = []
+	for name, result in sorted(results.items()):
+		old_result = baseline.get(name)
+		if not old_result:
+			continue
+		for field in compared_fields:
+			old, new = old_result.get(field), result.get(field)
+			if not old or new is None:
+				continue
+			change = float(new - old) / old
+			if change > threshold:
+				regressions += [(name, field, old, new, change)]
+	return regressions
+
+def benchmark(version_name='ruby', names=None, repeat=3, project=None, **options):
+	"""
+	Run the scenarios on project, or on a synthetic project made with options,
+	and return a report of the results, what they were run on, and the commit and machine they ran at.
+	"""
+	run_info = bench_history.get_run_info()
+	temp = None
+	if not project:
+		temp = tempfile.mkdtemp(prefix='pret-agb-bench-')
+		make_project(temp, version_name, **options)
+	try:
+		results = run_benchmarks(os.path.abspath(project or temp), version_name, names, repeat)
+	finally:
+		if temp:
+			shutil.rmtree(temp)
+	report = {
+		'version': version_name,
+		'options': dict(options, project=project),
+		'python': platform.python_version(),
+		'scenarios': results,
+	}
+	report.update(run_info)
+	return report
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('version', nargs='?', default='ruby')
+	ap.add_argument('--scenario', action='append', choices=[name for name, function in scenarios], help='run only these (default: all)')
+	ap.add_argument('--repeat', type=int, default=3)
+	ap.add_argument('--seed', type=int, default=0)
+	ap.add_argument('--maps', type=int, default=64)
+	ap.add_argument('--groups', type=int, default=8)
+	ap.add_argument('--project', help='benchmark this project instead of a synthetic one')
+	ap.add_argument('--output', help='write results here as json (default: stdout)')
+	ap.add_argument('--baseline', help='json from an earlier run to compare against')
+	ap.add_argument('--threshold', type=float, default=0.1, help='how much slower or bigger than the baseline is a regression (default: 0.1)')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	report = benchmark(args.version, args.scenario, args.repeat, args.project, seed=args.seed, maps=args.maps, groups=args.groups)
+	text = json.dumps(report, indent=1, sort_keys=True)
+	if args.output:
+		open(args.output, 'w').write(text + '\n')
+	else:
+		print text
+
+	if args.baseline:
+		baseline = json.load(open(args.baseline))['scenarios']
+		regressions = compare(report['scenarios'], baseline, args.threshold)
+		for name, field, old, new, change in regressions:
+			sys.stderr.write('regression: {} {} {} -> {} (+{:.0%})\n'.format(name, field, old, new, change))
+		if regressions:
+			sys.exit(1)
+
+if __name__ == '__main__':
+	main()
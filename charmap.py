@@ -32,9 +32,12 @@ def encode(input, encode_charmap):
 	while i < len_old:
 		char = old[i]
 		if char == '{':
-			j = i + old.find('}', i) + 1
+			j = old.find('}', i) + 1
 			char = old[i:j]
 			i = j
+		elif char == '\\':
+			char = old[i:i + 2]
+			i += 2
 		else:
 			i += 1
 		chars = encode_charmap.get(char)
@@ -0,0 +1,374 @@
+"""
+The gba bios compression formats: LZ77 (0x10), Huffman (0x24/0x28) and RLE (0x30).
+
+Every stream starts with a 4-byte header: the type in the first byte and the
+decompressed size in the other three. Decompressing is the only way to find
+out how long the compressed data is, so that's how the chunks size themselves.
+
+	$ python pret-agb/compression.py 300000 400000
+"""
+
+import heapq
+import os
+import struct
+
+from script import *
+
+LZ77 = 0x10
+HUFF = 0x20
+RLE = 0x30
+
+max_size = 0x40000 # sanity limit for scanning; larger than any real stream
+
+
+class DecompressionError(Exception):
+	pass
+
+def read_header(data, address):
+	kind = data[address]
+	size = data[address + 1] | (data[address + 2] << 8) | (data[address + 3] << 16)
+	return kind, size
+
+
+def decompress_lz77(data, address=0):
+	"""Returns (decompressed, compressed length)."""
+	kind, size = read_header(data, address)
+	if kind != LZ77:
+		raise DecompressionError('not lz77 at 0x{:x}'.format(address))
+	out = bytearray()
+	i = address + 4
+	while len(out) < size:
+		flags = data[i]
+		i += 1
+		for bit in xrange(8):
+			if len(out) >= size:
+				break
+			if flags & (0x80 >> bit):
+				length = (data[i] >> 4) + 3
+				disp = (((data[i] & 0xf) << 8) | data[i + 1]) + 1
+				i += 2
+				start = len(out) - disp
+				if start < 0:
+					raise DecompressionError('lz77 at 0x{:x} refers before its start'.format(address))
+				if disp >= length:
+					out += out[start:start + length]
+				else:
+					# The copy overlaps itself, so it repeats the last disp bytes.
+					out += (out[start:] * (length // disp + 1))[:length]
+			else:
+				out.append(data[i])
+				i += 1
+	return out[:size], i - address
+
+def compress_lz77(data, window=0x1000, min_disp=2):
+	"""
+	Greedy LZ77 using a hash chain of 3-byte prefixes.
+	min_disp=2 keeps the output safe to decompress straight into vram.
+	"""
+	data = bytearray(data)
+	size = len(data)
+	out = bytearray([LZ77, size & 0xff, (size >> 8) & 0xff, (size >> 16) & 0xff])
+	chains = {}
+	def add(j):
+		if j + 3 <= size:
+			chains.setdefault(str(data[j:j + 3]), []).append(j)
+	i = 0
+	while i < size:
+		flags_index = len(out)
+		out.append(0)
+		for bit in xrange(8):
+			if i >= size:
+				break
+			best_length, best_disp = 0, 0
+			for j in reversed(chains.get(str(data[i:i + 3]), [])):
+				disp = i - j
+				if disp > window:
+					break
+				if disp < min_disp:
+					continue
+				length = 3
+				while length < 18 and i + length < size and data[j + length] == data[i + length]:
+					length += 1
+				if length > best_length:
+					best_length, best_disp = length, disp
+					if length == 18:
+						break
+			if best_length >= 3:
+				out[flags_index] |= 0x80 >> bit
+				out.extend([((best_length - 3) << 4) | ((best_disp - 1) >> 8), (best_disp - 1) & 0xff])
+				for j in xrange(i, i + best_length):
+					add(j)
+				i += best_length
+			else:
+				out.append(data[i])
+				add(i)
+				i += 1
+	while len(out) % 4:
+		out.append(0)
+	return out
+
+
+def decompress_rle(data, address=0):
+	kind, size = read_header(data, address)
+	if kind != RLE:
+		raise DecompressionError('not rle at 0x{:x}'.format(address))
+	out = bytearray()
+	i = address + 4
+	while len(out) < size:
+		flag = data[i]
+		i += 1
+		if flag & 0x80:
+			out += data[i:i + 1] * ((flag & 0x7f) + 3)
+			i += 1
+		else:
+			length = (flag & 0x7f) + 1
+			out += data[i:i + length]
+			i += length
+	return out[:size], i - address
+
+def compress_rle(data):
+	data = bytearray(data)
+	size = len(data)
+	out = bytearray([RLE, size & 0xff, (size >> 8) & 0xff, (size >> 16) & 0xff])
+	literal = bytearray()
+	def flush():
+		if literal:
+			out.append(len(literal) - 1)
+			out.extend(literal)
+			del literal[:]
+	i = 0
+	while i < size:
+		run = 1
+		while run < 0x82 and i + run < size and data[i + run] == data[i]:
+			run += 1
+		if run >= 3:
+			flush()
+			out.extend([0x80 | (run - 3), data[i]])
+			i += run
+		else:
+			literal.append(data[i])
+			if len(literal) == 0x80:
+				flush()
+			i += 1
+	flush()
+	while len(out) % 4:
+		out.append(0)
+	return out
+
+
+def decompress_huff(data, address=0):
+	"""
+	The tree follows the header: a size byte, then the root node. Each node's
+	low 6 bits give the offset to its pair of children, and bits 7 and 6 say
+	whether the left and right child are data. The bitstream is read from
+	32-bit words, most significant bit first, with 0 going left.
+	"""
+	kind, size = read_header(data, address)
+	bits = kind & 0xf
+	if kind & 0xf0 != HUFF or bits not in (4, 8):
+		raise DecompressionError('not huffman at 0x{:x}'.format(address))
+	root = address + 5
+	i = address + 4 + (data[address + 4] + 1) * 2
+	out = bytearray()
+	low = None
+	node = root
+	while len(out) < size:
+		word = data[i] | (data[i + 1] << 8) | (data[i + 2] << 16) | (data[i + 3] << 24)
+		i += 4
+		for shift in xrange(31, -1, -1):
+			bit = (word >> shift) & 1
+			flags = data[node]
+			child = (node & ~1) + (flags & 0x3f) * 2 + 2 + bit
+			if not flags & (0x80 >> bit):
+				node = child
+				continue
+			value = data[child]
+			node = root
+			if bits == 8:
+				out.append(value)
+			elif low is None:
+				low = value & 0xf
+			else:
+				out.append(low | ((value & 0xf) << 4))
+				low = None
+			if len(out) >= size:
+				break
+	return out[:size], i - address
+
+def compress_huff(data, bits=8):
+	"""
+	Node offsets only have 6 bits, so the tree is laid out breadth first to keep
+	children close to their parents. That is always enough for 4-bit data, but an
+	8-bit tree with close to 256 evenly spread symbols can't be encoded.
+	"""
+	data = bytearray(data)
+	size = len(data)
+	if bits == 4:
+		symbols = []
+		for byte in data:
+			symbols += [byte & 0xf, byte >> 4]
+	else:
+		symbols = list(data)
+
+	counts = {}
+	for symbol in symbols:
+		counts[symbol] = counts.get(symbol, 0) + 1
+	if len(counts) < 2:
+		# A tree needs two leaves.
+		counts.setdefault((symbols[0] if symbols else 0) ^ 1, 0)
+
+	# Leaves are ints, internal nodes are (left, right) tuples.
+	heap = [(count, i, symbol) for i, (symbol, count) in enumerate(sorted(counts.items()))]
+	heapq.heapify(heap)
+	order = len(heap)
+	while len(heap) > 1:
+		count0, _, node0 = heapq.heappop(heap)
+		count1, _, node1 = heapq.heappop(heap)
+		heapq.heappush(heap, (count0 + count1, order, (node0, node1)))
+		order += 1
+	tree = heap[0][2]
+
+	# Lay the tree out breadth first. Slot 0 is the root, and each internal node's
+	# children go in the next free pair of slots (pair p is slots 2p+1 and 2p+2).
+	slots = [tree]
+	codes = {}
+	queue = [(tree, 0, '')]
+	pairs = 0
+	while queue:
+		node, slot, code = queue.pop(0)
+		if not isinstance(node, tuple):
+			codes[node] = code
+			continue
+		own_pair = (slot - 1) // 2 if slot else -1
+		offset = pairs - own_pair - 1
+		if offset > 0x3f:
+			raise ValueError('huffman tree is too wide to encode')
+		child_slot = 2 * pairs + 1
+		slots += list(node)
+		flags = offset
+		for bit, child in enumerate(node):
+			if not isinstance(child, tuple):
+				flags |= 0x80 >> bit
+			queue.append((child, child_slot + bit, code + str(bit)))
+		slots[slot] = flags
+		pairs += 1
+	# Internal nodes now hold their flags, and leaves their value.
+	table = bytearray([0]) + bytearray(slots)
+	while len(table) % 4:
+		table.append(0)
+	table[0] = len(table) // 2 - 1
+
+	out = bytearray([HUFF | bits, size & 0xff, (size >> 8) & 0xff, (size >> 16) & 0xff]) + table
+	stream = ''.join(codes[symbol] for symbol in symbols)
+	stream += '0' * (-len(stream) % 32)
+	for j in xrange(0, len(stream), 32):
+		out += struct.pack('<I', int(stream[j:j + 32], 2))
+	return out
+
+
+decompressors = {
+	LZ77: decompress_lz77,
+	RLE: decompress_rle,
+	HUFF | 4: decompress_huff,
+	HUFF | 8: decompress_huff,
+}
+
+def decompress(data, address=0):
+	"""Returns (decompressed, compressed length) for whichever format the header says."""
+	decompressor = decompressors.get(data[address])
+	if decompressor is None:
+		raise DecompressionError('unknown compression 0x{:02x} at 0x{:x}'.format(data[address], address))
+	return decompressor(data, address)
+
+
+class CompressedFile(BinFile):
+	"""
+	A compressed stream, sized by decompressing it.
+	The stream is written as is, plus the decompressed data without the extension
+	(or without its last extension, if the filename doesn't end in this class's).
+	"""
+	extension = ''
+	filename = None
+	def parse(self):
+		Chunk.parse(self)
+		try:
+			self.data, self.size = self.decompress(self.rom, self.address)
+		except IndexError:
+			raise DecompressionError('{!r} runs past the end of the rom'.format(self))
+		if self.filename is None:
+			self.filename = 'graphics/unsorted/{}.bin{}'.format(hex(self.address), self.extension)
+		BinFile.parse(self)
+	def decompress(self, data, address):
+		return decompress(data, address)
+	def get_files(self):
+		if self.extension and self.filename.endswith(self.extension):
+			filename = self.filename[:-len(self.extension)]
+		else:
+			filename = os.path.splitext(self.filename)[0]
+		return BinFile.get_files(self) + [(filename, bytes(self.data))]
+
+class LZ77File(CompressedFile):
+	extension = '.lz'
+	def decompress(self, data, address):
+		return decompress_lz77(data, address)
+
+class RLEFile(CompressedFile):
+	extension = '.rl'
+	def decompress(self, data, address):
+		return decompress_rle(data, address)
+
+class HuffFile(CompressedFile):
+	extension = '.huff'
+	def decompress(self, data, address):
+		return decompress_huff(data, address)
+
+compressed_file_classes = {
+	LZ77: LZ77File,
+	RLE: RLEFile,
+	HUFF | 4: HuffFile,
+	HUFF | 8: HuffFile,
+}
+
+
+def scan_compressed(rom, start, end, min_size=0x20):
+	"""
+	Find plausible compressed streams in start..end: word aligned, with a
+	known header, a size between min_size and max_size, and data that
+	decompresses without error and without running past end.
+	Yields (address, class, compressed length, decompressed size).
+	Scanning resumes after the end of each stream that is found.
+	"""
+	end = min(end, len(rom))
+	next_address = 0
+	for address in xrange(start + (-start % 4), end - 4, 4):
+		if address < next_address:
+			continue
+		class_ = compressed_file_classes.get(rom[address])
+		if class_ is None:
+			continue
+		size = rom[address + 1] | (rom[address + 2] << 8) | (rom[address + 3] << 16)
+		if not min_size <= size <= max_size:
+			continue
+		try:
+			data, length = decompress(rom, address)
+		except (DecompressionError, IndexError):
+			continue
+		if address + length > end:
+			continue
+		next_address = address + length
+		yield address, class_, length, size
+
+
+def main():
+	args = get_args(
+		'start',
+		'end',
+		('version', {'nargs': '?', 'default': 'ruby'}),
+		('--min-size', {'type': lambda x: int(x, 0), 'default': 0x20}),
+	)
+	version = get_setup_version(args.version)
+	for address, class_, length, size in scan_compressed(version['baserom'], int(args.start, 16), int(args.end, 16), args.min_size):
+		print '0x{:x}: {} 0x{:x} bytes -> 0x{:x}'.format(address, class_.__name__, length, size)
+
+if __name__ == '__main__':
+	main()
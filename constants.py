@@ -2,24 +2,27 @@
 
 from os.path import exists
 
-def find_labels(path):
-	labels = {}
+def iter_labels(path):
+	"""(address, label, path) for each label with an address comment, in path and the files it includes."""
 	if not exists(path):
-		return labels
+		return
 	lines = open(path).readlines()
 	for line in lines:
 		if '.include' in line:
 			incpath = line.split('"')[1]
-			labels.update(find_labels(incpath))
+			for item in iter_labels(incpath):
+				yield item
 		elif ': @' in line:
 			i = line.find(':')
 			j = line.find('@', i) + 1
 			try:
 				label, address = line[:i], int(line[j:].split()[0], 16)
-				labels[address] = label
 			except:
-				pass
-	return labels
+				continue
+			yield address, label, path
+
+def find_labels(path):
+	return {address: label for address, label, path_ in iter_labels(path)}
 
 def load_rom(filename):
     return bytearray(open(filename).read())
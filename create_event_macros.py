@@ -326,9 +326,19 @@ def pretty_print_commands(commands):
 	text = text.replace('\t', ' ' * 4)
 	return text
 
-if __name__ == '__main__':
+def main():
+	from argparse import ArgumentParser
+	import profiling
+	ap = ArgumentParser()
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
 	commands = read_lapis_yaml()
 	commands = override_from_html(commands)
 	commands = override_commands(commands)
 	print pretty_print_commands(commands)[:-1]
 	#print make_event_macros(commands)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,164 @@
+"""
+A resident disassembly server, and a thin client for it.
+
+The server keeps one Session per version warm and answers one JSON request
+per line over a local unix socket. Clients are served concurrently through
+AsyncSession, which shares parses of the same root and serialises writes to
+the same file. The client imports nothing heavy, so
+repeat queries skip loading the command tables, rom, constants and labels.
+
+	$ python pret-agb/daemon.py serve &
+	$ python pret-agb/daemon.py print Text 1b6e63
+	$ python pret-agb/daemon.py label 1b6e63
+	$ python pret-agb/daemon.py insert Text 1b6e63
+
+Requests look like {"command": "print", "class": "Text", "address": "1b6e63", "version": "ruby"}.
+Responses are {"result": ...} or {"error": "..."}.
+"""
+
+import json
+import os
+import signal
+import socket
+import SocketServer
+import sys
+import threading
+
+import profiling
+
+default_socket_path = '.pret-agb.sock'
+
+
+def get_address(value):
+	if isinstance(value, basestring):
+		return int(value, 16)
+	return value
+
+
+class Server(object):
+	def __init__(self):
+		from async_session import AsyncSession
+		from script import get_classes
+		self.AsyncSession = AsyncSession
+		self.classes = get_classes()
+		self.sessions = {}
+		self.lock = threading.Lock()
+
+	def get_session(self, version_name):
+		with self.lock:
+			if version_name not in self.sessions:
+				self.sessions[version_name] = self.AsyncSession(version_name)
+			return self.sessions[version_name]
+
+	def get_class(self, name):
+		class_ = self.classes.get(name)
+		if not isinstance(class_, type):
+			raise Exception('unknown class {}'.format(name))
+		return class_
+
+	def handle(self, request):
+		command = request.get('command')
+		handler = getattr(self, 'do_' + str(command), None)
+		if handler is None:
+			raise Exception('unknown command {}'.format(command))
+		session = self.get_session(request.get('version', 'ruby'))
+		return handler(session, request)
+
+	def do_ping(self, session, request):
+		return 'pong'
+
+	def do_print(self, session, request):
+		class_ = self.get_class(request['class'])
+		return session.print_recursive(class_, get_address(request['address'])).get()
+
+	def do_insert(self, session, request):
+		class_ = self.get_class(request['class'])
+		session.insert_recursive(class_, get_address(request['address']), request.get('paths')).get()
+
+	def do_label(self, session, request):
+		address = get_address(request['address']) & 0x1ffffff
+		return session.session.labels.get(0x8000000 + address)
+
+	def do_reload(self, session, request):
+		with session.session_lock:
+			session.session.reload_labels()
+
+
+class RequestHandler(SocketServer.StreamRequestHandler):
+	def handle(self):
+		for line in self.rfile:
+			if not line.strip():
+				continue
+			try:
+				response = {'result': self.server.disassembler.handle(json.loads(line))}
+			except Exception as e:
+				response = {'error': '{}: {}'.format(e.__class__.__name__, e)}
+			self.wfile.write(json.dumps(response) + '\n')
+			self.wfile.flush()
+
+class ThreadingUnixStreamServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+	daemon_threads = True
+
+def serve(path=default_socket_path):
+	if os.path.exists(path):
+		os.remove(path)
+	server = ThreadingUnixStreamServer(path, RequestHandler)
+	server.disassembler = Server()
+	signal.signal(signal.SIGTERM, lambda *args: sys.exit())
+	try:
+		server.serve_forever()
+	finally:
+		os.remove(path)
+
+
+def request(message, path=default_socket_path):
+	client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	client.connect(path)
+	client.sendall(json.dumps(message) + '\n')
+	client.shutdown(socket.SHUT_WR)
+	response = ''
+	while True:
+		data = client.recv(1 << 16)
+		if not data:
+			break
+		response += data
+	client.close()
+	response = json.loads(response)
+	if 'error' in response:
+		raise Exception(response['error'])
+	return response.get('result')
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('--socket', default=default_socket_path)
+	ap.add_argument('--version', default='ruby')
+	ap.add_argument('command', choices=['serve', 'ping', 'print', 'insert', 'label', 'reload'])
+	ap.add_argument('args', nargs='*')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	if args.command == 'serve':
+		serve(args.socket)
+		return
+
+	message = {'command': args.command, 'version': args.version}
+	if args.command in ('print', 'insert'):
+		if len(args.args) != 2:
+			ap.error('{} takes a class name and an address'.format(args.command))
+		message['class'], message['address'] = args.args
+	elif args.command == 'label':
+		if len(args.args) != 1:
+			ap.error('label takes an address')
+		message['address'], = args.args
+	try:
+		result = request(message, args.socket)
+	except Exception as e:
+		sys.exit(str(e))
+	if result is not None:
+		print result.encode('utf-8') if isinstance(result, unicode) else result
+
+if __name__ == '__main__':
+	main()
@@ -1,4 +1,7 @@
+import os
+
 from script import *
+import profiling
 import versions
 
 class Graphic(BinFile):
@@ -59,7 +62,6 @@ class Palette(BinFile):
 
 class PalPointer(RomPointer):
 	target = Palette
-	target_arg_names = ['size', 'filename']
 
 class ObjPal(Macro):
 	name = 'obj_pal'
@@ -97,46 +99,89 @@ class ObjTilesList(List):
 	param_classes = [ObjTilesOrObjPal]
 
 
-def read_incbin(line):
-	line = line.split('@')[0]
-	params = line.split('.incbin')[1].split(',')
-	return map(str.strip, params)
+def create_images_of_chunks(chunks, width=8):
+	"""
+	Write a png next to each ObjTiles graphic, colored with the ObjPal of the same tag if there is one.
+	Returns the filenames that were written, like write_files.
+	"""
+	from gba_graphics import decode_4bpp, decode_palette, encode_png, grayscale_palette, tiles_to_sheet
+	by_address = {chunk.address: chunk for chunk in chunks if isinstance(chunk, BinFile)}
+	palettes = {}
+	for chunk in chunks:
+		if isinstance(chunk, ObjPal):
+			palette = by_address.get(chunk.params['address'].real_address)
+			if isinstance(palette, Palette):
+				palettes[chunk.params['tag'].value] = decode_palette(palette.value)
+	files = []
+	for chunk in chunks:
+		if isinstance(chunk, ObjTiles):
+			graphic = by_address.get(chunk.params['address'].real_address)
+			if not isinstance(graphic, Graphic):
+				continue
+			palette = palettes.get(chunk.params['tag'].value, grayscale_palette)
+			filename = os.path.splitext(graphic.filename)[0] + '.png'
+			files += [(filename, encode_png(tiles_to_sheet(decode_4bpp(graphic.value), width), palette))]
+	return write_files(files)
+
 
-def dump_graphics(filename, version):
-	setup_version(version)
+def dump_graphics(filename, version_name='ruby', png=False, referenced=None, version=None):
+	"""
+	Find ObjTilesLists in the incbins of filename and insert them.
+	If referenced(start, end) is given (such as Xrefs.referenced), spans it says
+	nothing points at aren't tried at all.
+	"""
+	from pointer_scan import PointerScan
+	if version is None:
+		version = get_setup_version(version_name)
+	scan = PointerScan(version['baserom'])
+	index = IncbinIndex(version['maps_paths'], version['baserom_path'])
 	chunks = []
-	for line in open(filename):
-		if '.incbin "baserom.gba"' in line:
-			_, start, length = read_incbin(line)
-			start = int(start, 16)
-			length = int(length, 16)
+	for kind, i, start, end in index.get_file(filename)[1]:
+		if kind == 'incbin' and end is not None:
+			length = end - start
 			count = length / ObjTiles._length
 			if (not count) or length % ObjTiles._length:
 				continue
+			if referenced is not None and not referenced(start):
+				continue
+			# Only spans where every other word is a pointer can be ObjTilesLists.
+			if start % 4 or not scan.covers(start, start + length, 2):
+				continue
 			try:
 				chunks_ = recursive_parse(
 					ObjTilesList.extend(count=count),
 					start,
 					version=version,
+					rom=version['baserom'],
 				)
 			except:
 				continue
 			chunks += chunks_.values()
 	chunks = flatten_nested_chunks(chunks)
 
-	# version.ruby is intentional. i think.
 	for path in version['maps_paths']:
-		insert_chunks(chunks, path, versions.ruby)
+		insert_chunks(chunks, path, version, index=index)
 	if filename not in version['maps_paths']:
-		insert_chunks(chunks, filename, versions.ruby)
+		insert_chunks(chunks, filename, version, index=index)
 	create_files_of_chunks(chunks)
+	if png:
+		create_images_of_chunks(chunks)
 
 def main():
 	from argparse import ArgumentParser as ap
 	ap = ap()
 	ap.add_argument('filename')
+	ap.add_argument('--png', action='store_true', help='also write a png of each graphic')
+	ap.add_argument('--xrefs', action='store_true', help='only try spans that something points at, using the saved xref index')
+	profiling.add_profile_arguments(ap)
 	args = ap.parse_args()
-	dump_graphics(args.filename, versions.ruby)
+	profiling.start_profile(args)
+	if args.xrefs:
+		from xref import get_xrefs
+		session = Session('ruby')
+		dump_graphics(args.filename, png=args.png, referenced=get_xrefs(session).referenced, version=session.version)
+	else:
+		dump_graphics(args.filename, 'ruby', args.png)
 
 if __name__ == '__main__':
 	main()
@@ -1,6 +1,14 @@
+import hashlib
+import json
+from multiprocessing import Pool, cpu_count
 import os
+import sys
+import time
 
 from event_script import *
+from compression import LZ77File
+import profiling
+from progress import get_progress, progress_argument, quiet
 import versions
 import find_files
 
@@ -12,8 +20,136 @@ def dump_maps(version):
 	label = Label(address, asm='gMapGroups')
 	chunks = recursive_parse(MapGroups, address, version=version, rom=rom)
 	chunks[address].label = label
+	get_tilesets(version).share_files(chunks.values())
 	return chunks.values()
 
+def dump_map_group(group, version=None):
+	"""
+	Parse one map group a map at a time, and render it.
+	Returns (group, chunks, labels, files, timings), where chunks and labels are
+	(owner, address, last address, asm), files are (owner, filename, data) and timings are
+	(map name, seconds). The owner is the address of the parsed chunk each came from.
+	It's all plain data so it can come back from a worker process.
+	"""
+	if version is None:
+		version = worker_version
+	rom = version['baserom']
+	groups = MapGroups(version['map_groups_address'], version=version, rom=rom)
+	address = groups.chunks[group].real_address
+	map_group = MapGroup(address, group=group, version=version, rom=rom)
+	visited = {address: map_group}
+	timings = []
+	for num, map_p in enumerate(map_group.chunks):
+		start = time.time()
+		recursive_parse_all([(Map.extend(group=group, num=num), map_p.real_address)], visited=visited, version=version, rom=rom)
+		timings += [(get_map_name(version['map_groups'], group, num), time.time() - start)]
+	get_tilesets(version).share_files(visited.values())
+
+	chunks, labels, files = [], [], []
+	for owner, parsed in visited.items():
+		for chunk in flatten_nested_chunks([parsed]):
+			item = (owner, chunk.address, chunk.last_address, chunk.to_asm())
+			if isinstance(chunk, Label):
+				labels += [item]
+			else:
+				chunks += [item]
+			if hasattr(chunk, 'get_files'):
+				files += [(owner,) + tuple(f) for f in chunk.get_files()]
+	return group, chunks, labels, files, timings
+
+def merge_map_groups(results):
+	"""
+	Merge dump_map_group results in group order. A chunk that an earlier group
+	already parsed (shared scripts, tilesets) is dropped, along with the labels and
+	files that came from it, since the other group parsed it under its own map's names.
+	That leaves what a serial dump would have.
+	Returns (chunks, files).
+	"""
+	chunks = []
+	files = {}
+	parsed = set()
+	for group, rendered, labels, group_files, timings in sorted(results):
+		owners = set(item[0] for item in rendered + labels + group_files) - parsed
+		chunks += [RenderedChunk(*item[1:]) for item in rendered + labels if item[0] in owners]
+		for owner, filename, data in group_files:
+			if owner in owners:
+				files.setdefault(filename, data)
+		parsed.update(owners)
+	return chunks, sorted(files.items())
+
+def dump_maps_parallel(version, workers=None, progress=quiet):
+	"""
+	Like dump_maps, but each map group is parsed in its own worker process.
+	Each group that finishes is a step of progress's 'parse' stage.
+	Returns (chunks, files, timings).
+	"""
+	global worker_version
+	worker_version = version # inherited by the workers when they fork
+	if workers is None:
+		workers = cpu_count()
+	rom = version['baserom']
+	address = version['map_groups_address']
+	groups = MapGroups(address, version=version, rom=rom)
+	groups.label = Label(address, asm='gMapGroups')
+	chunks = [RenderedChunk(c.address, c.last_address, c.to_asm()) for c in flatten_nested_chunks([groups])]
+
+	num_groups = len(groups.chunks)
+	pool = None
+	if workers > 1:
+		pool = Pool(workers)
+		results = pool.imap_unordered(dump_map_group, xrange(num_groups))
+	else:
+		results = (dump_map_group(group, version) for group in xrange(num_groups))
+	finished = []
+	try:
+		with progress.stage('parse', total=num_groups, unit='groups') as stage:
+			for result in results:
+				finished += [result]
+				group, rendered, timings = result[0], result[1], result[-1]
+				stage.advance(
+					bytes=sum(last_address - address for owner, address, last_address, asm in rendered),
+					detail='group {}: {} maps in {:.2f}s'.format(group, len(timings), sum(t for name, t in timings)),
+				)
+	finally:
+		if pool:
+			pool.close()
+			pool.join()
+
+	group_chunks, files = merge_map_groups(finished)
+	timings = sorted((t for result in finished for t in result[-1]), key=lambda item: -item[1])
+	return chunks + group_chunks, files, timings
+
+def check_parallel(version_name='ruby', workers=None):
+	"""
+	Dump the maps both serially and in parallel, and return what differs:
+	(rendered chunks only in the serial dump, only in the parallel one, files that differ).
+	"""
+	version = get_setup_version(version_name)
+	serial = flatten_nested_chunks(dump_maps(version))
+	serial_files = {}
+	for chunk in serial:
+		if hasattr(chunk, 'get_files'):
+			serial_files.update(chunk.get_files())
+	chunks, files, timings = dump_maps_parallel(get_setup_version(version_name), workers)
+	serial, chunks = set(sort_chunks(serial)), set(sort_chunks(chunks))
+	files = dict(files)
+	return (
+		sorted(serial - chunks),
+		sorted(chunks - serial),
+		sorted(name for name in set(serial_files) | set(files) if serial_files.get(name) != files.get(name)),
+	)
+
+def iter_maps(version):
+	"""
+	Yield every Map header in gMapGroups, without following any of its pointers.
+	"""
+	rom = version['baserom']
+	groups = MapGroups(version['map_groups_address'], version=version, rom=rom)
+	for group, group_p in enumerate(groups.chunks):
+		map_group = MapGroup(group_p.real_address, group=group, version=version, rom=rom)
+		for num, map_p in enumerate(map_group.chunks):
+			yield Map(map_p.real_address, group=group, num=num, version=version, rom=rom)
+
 
 class MapBorder(BinFile):
 	size = 4 * 2
@@ -34,7 +170,8 @@ class MapBlockdataPointer(Pointer):
 class TilesetImage(Chunk): pass
 class TilesetImagePointer(Pointer):
 	target = TilesetImage
-class TilesetPalettes(Chunk): pass
+class TilesetPalettes(BinFile):
+	size = 16 * 0x20
 class TilesetPalettesPointer(Pointer):
 	target = TilesetPalettes
 class TilesetBlocks(Chunk): pass
@@ -48,18 +185,109 @@ class TilesetBehaviorPointer(ThumbPointer): pass
 #	target = TilesetBehavior
 
 class Tileset(ParamGroup):
+	kind = 'primary'
 	param_classes = [
-		Byte, Byte, Byte, Byte,
-		TilesetImagePointer, TilesetPalettesPointer, TilesetBlocksPointer, TilesetAnimationsPointer, TilesetBehaviorPointer,
+		('compressed', Byte), Byte, Byte, Byte,
+		('image_p', TilesetImagePointer), ('palettes_p', TilesetPalettesPointer), TilesetBlocksPointer, TilesetAnimationsPointer, TilesetBehaviorPointer,
 	]
+	def parse(self):
+		ParamGroup.parse(self)
+		path = get_tilesets(self.version).get_path(self.address, self.kind)
+		if self.params['compressed'].value:
+			self.params['image_p'].target = LZ77File.extend(filename=os.path.join(path, 'tiles.4bpp.lz'))
+		self.params['palettes_p'].target = TilesetPalettes.extend(filename=os.path.join(path, 'palettes.gbapal'))
 class TilesetPointer(Pointer):
 	target = Tileset
 	include_address = False
 
-class Tileset2(Tileset): pass
+class Tileset2(Tileset):
+	kind = 'secondary'
 class Tileset2Pointer(TilesetPointer):
 	target = Tileset2
 
+
+class TilesetRegistry(object):
+	"""
+	Every tileset in one version, by address: its name, where its files go,
+	and which maps use it. Each tileset gets one label that every map's pointer
+	shares, instead of one per map that happen to be at the same address.
+
+	Tileset files are also indexed by content hash, so an asset that is
+	byte for byte the same as one dumped before (say, from the other version)
+	reuses that file instead of being written again.
+	"""
+	hashes_path = '.pret-agb-assets.json'
+
+	def __init__(self, version):
+		self.version = version
+		self.labels = {}
+		self.users = {}
+		self.hashes = {}
+		if os.path.exists(self.hashes_path):
+			self.hashes = json.load(open(self.hashes_path))
+
+	def get_label(self, address):
+		if address not in self.labels:
+			asm = self.version['labels'].get(0x8000000 + address) or 'gTileset_{:X}'.format(address)
+			self.labels[address] = Label(address, asm=asm, is_global=True)
+		return self.labels[address]
+
+	def get_path(self, address, kind):
+		name = self.get_label(address).asm
+		if name.startswith('gTileset_'):
+			name = name[len('gTileset_'):]
+		return os.path.join('data', 'tilesets', kind, name.lower())
+
+	def add_user(self, pointer, map_name):
+		"""Record that map_name uses the tileset pointer points to, and give the pointer its label."""
+		address = pointer.real_address
+		if not address:
+			return
+		self.users.setdefault(address, []).append(map_name)
+		pointer.label = self.get_label(address)
+
+	def share_files(self, chunks):
+		"""
+		Point tileset files at earlier files with the same contents.
+		A file whose name is already taken by different contents gets the version added to its name.
+		"""
+		taken = set(self.hashes.values())
+		for chunk in chunks:
+			if isinstance(chunk, BinFile) and chunk.filename.startswith(os.path.join('data', 'tilesets', '')):
+				digest = hashlib.sha1(bytes(bytearray(chunk.value))).hexdigest()
+				if digest not in self.hashes:
+					if chunk.filename in taken:
+						directory, name = os.path.split(chunk.filename)
+						stem, extension = name.split('.', 1)
+						chunk.filename = os.path.join(directory, '{}_{}.{}'.format(stem, self.version['version'], extension))
+					self.hashes[digest] = chunk.filename
+					taken.add(chunk.filename)
+				chunk.filename = self.hashes[digest]
+
+	def record_files(self, files):
+		"""Add written tileset files to the content hash index, and save it."""
+		for filename, data in files:
+			if filename.startswith(os.path.join('data', 'tilesets', '')) and filename.endswith(('.lz', '.gbapal')):
+				self.hashes.setdefault(hashlib.sha1(data).hexdigest(), filename)
+		with open(self.hashes_path, 'w') as out:
+			json.dump(self.hashes, out, indent=1, sort_keys=True)
+
+def get_tilesets(version):
+	if 'tilesets' not in version:
+		version['tilesets'] = TilesetRegistry(version)
+	return version['tilesets']
+
+def get_tileset_users(version):
+	"""{tileset address: [map names]}, from the map headers alone."""
+	tilesets = get_tilesets(version)
+	for map_ in iter_maps(version):
+		MapAttributes(
+			map_.params['attributes_p'].real_address,
+			group=map_.group, num=map_.num,
+			version=version, rom=version['baserom'],
+		)
+	return tilesets.users
+
 class MapAttributes(ParamGroup):
 	param_classes = [
 		('width', Int), ('height', Int),
@@ -78,6 +306,9 @@ class MapAttributes(ParamGroup):
 		blockdata_p.filename = 'data/maps/{}/map.bin'.format(map_name)
 		border_p = self.params['border_p']
 		border_p.filename = 'data/maps/{}/border.bin'.format(map_name)
+		tilesets = get_tilesets(self.version)
+		tilesets.add_user(self.chunks[4], map_name)
+		tilesets.add_user(self.chunks[5], map_name)
 
 class MapAttributesPointer(Pointer):
 	target = MapAttributes
@@ -346,14 +577,51 @@ if __name__ == '__main__':
     ap = ap()
     ap.add_argument('version', nargs='?', default='ruby')
     ap.add_argument('--debug', action='store_true')
+    ap.add_argument('--workers', type=int, default=None, help='processes to parse map groups in (default: one per cpu)')
+    ap.add_argument('--slowest', type=int, default=10, help='list this many of the slowest maps to parse')
+    ap.add_argument('--tilesets', action='store_true', help='list the maps that use each tileset')
+    ap.add_argument('--check', action='store_true', help='check that a parallel dump renders the same as a serial one, without writing anything')
+    ap.add_argument(progress_argument[0], **progress_argument[1])
+    profiling.add_profile_arguments(ap)
     args = ap.parse_args()
-    version = versions.__dict__[args.version]
-    setup_version(version)
-    if args.debug:
+    if profiling.start_profile(args) and args.workers is None:
+        args.workers = 1 # workers' counts would be lost
+    version = get_setup_version(args.version)
+    if args.tilesets:
+        tilesets = get_tilesets(version)
+        for address, users in sorted(get_tileset_users(version).items()):
+            print '{} (0x{:x}): {}'.format(tilesets.get_label(address).asm, address, ', '.join(users))
+    elif args.check:
+        only_serial, only_parallel, files = check_parallel(args.version, args.workers)
+        for address, last_address, asm in only_serial:
+            print 'serial only: 0x{:x}-0x{:x} {}'.format(address, last_address, asm.splitlines()[0] if asm else '')
+        for address, last_address, asm in only_parallel:
+            print 'parallel only: 0x{:x}-0x{:x} {}'.format(address, last_address, asm.splitlines()[0] if asm else '')
+        for filename in files:
+            print 'file differs: ' + filename
+        if only_serial or only_parallel or files:
+            sys.exit(1)
+        print 'identical'
+    elif args.debug:
         print print_nested_chunks(dump_maps(version))
     else:
-        chunks = flatten_nested_chunks(dump_maps(version))
-        for path in version['maps_paths']:
-            insert_chunks(chunks, path, version)
-        create_files_of_chunks(chunks)
-        find_files.main(version)
+        progress = get_progress(args.progress)
+        chunks, files, timings = dump_maps_parallel(version, args.workers, progress)
+        if progress.mode == 'json':
+            progress.emit({'event': 'slowest', 'maps': timings[:args.slowest]})
+        elif progress.out:
+            for name, seconds in timings[:args.slowest]:
+                sys.stderr.write('{}: {:.2f}s\n'.format(name, seconds))
+        paths = version['maps_paths']
+        index = IncbinIndex(paths, version['baserom_path'])
+        with progress.stage('insert', total=len(paths), unit='files') as stage:
+            for path in paths:
+                insert_chunks(chunks, path, version, index=index)
+                stage.advance(bytes=os.path.getsize(path) if os.path.exists(path) else 0, detail=path)
+        with progress.stage('write', total=len(files), unit='files') as stage:
+            written = write_files(files)
+            stage.advance(len(files), sum(len(data) for filename, data in files), '{} changed'.format(len(written)))
+        get_tilesets(version).record_files(files)
+        with progress.stage('split', total=1, unit='passes') as stage:
+            find_files.main(version)
+            stage.advance()
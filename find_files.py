@@ -1,34 +1,23 @@
-import os
+"""
+Split the map data that dump_maps inserted into data1.s and data2.s out into
+one file per map and kind of data.
 
-from script import is_label
-import versions
+Each kind of split is a Splitter that looks at one line at a time. All the
+splitters for a root file run together over a single read of it, chained in
+order: each one only passes on the lines it doesn't split out, so the next sees
+what the file would look like had the one before run on its own. Every output
+and the rewritten root are worked out before anything is written.
 
-g = ''
-
-def makedirs(*args, **kwargs):
-	try:
-		os.makedirs(*args, **kwargs)
-	except OSError:
-		pass
+	$ python pret-agb/find_files.py --dry-run
+"""
 
+import os
 
-def split_stuff(root, writes):
-
-	lines = open(root).readlines()
-	for start, end, filename in writes:
-		makedirs(os.path.dirname(filename))
-		open(filename, 'w').write(''.join(lines[start:end]))
-
-	i = 0
-	new_lines = []
-	lines = open(root).readlines()
-	for start, end, filename in writes:
-		new_lines += lines[i:start]
-		new_lines += ['\t.include "{}"\n'.format(filename)]
-		i = end
-	new_lines += lines[i:]
+import profiling
+from script import is_label, write_files
+import versions
 
-	open(root, 'w').write(''.join(new_lines))
+g = ''
 
 
 def get_label(line):
@@ -38,221 +27,287 @@ def get_label(line):
 		return line.split(':')[0].strip()
 
 
-def split_map_scripts(version):
+class Splitter(object):
+	"""
+	feed is called with every line that the splitters before this one leave in the file.
+	Setting start opens a split, write closes it, and setting done stops the splitter.
+	"""
 	root = 'data/data1.s'
+	filename = None
+
+	def __init__(self, version):
+		self.version = version
+		self.writes = []
+		self.seen = []
+		self.start = None
+		self.done = False
+		self.last = None
 
-	seen = []
-	def get_filename():
-		return 'data/maps/scripts/{}.s'.format(seen[-1])
+	def get_filename(self):
+		return self.filename.format(self.seen[-1])
 
-	writes = []
-	def write(start, end):
+	def write(self, start, end):
 		if start is not None:
-			writes.append((start, end, get_filename()))
+			self.writes.append((start, end, self.get_filename()))
+
+	def feed(self, i, line, label):
+		pass
 
-	start = None
-	for i, line in enumerate(open(root)):
-		label = get_label(line)
+	def finish(self):
+		pass
+
+	def run(self, stream):
+		"""
+		Feed (index, line, label) from stream, and pass on the lines that don't end up in a split.
+		Lines in an open split are held back until it is either written, and they're dropped,
+		or given up on, and they're passed on after all.
+		"""
+		held = []
+		for item in stream:
+			if self.done:
+				yield item
+				continue
+			held += [item]
+			self.last = item[0]
+			written = len(self.writes)
+			self.feed(*item)
+			for item in self.settle(held, written):
+				yield item
+		written = len(self.writes)
+		if not self.done:
+			self.finish()
+		self.start = None
+		for item in self.settle(held, written):
+			yield item
+
+	def settle(self, held, written):
+		"""Drop held lines that new writes took, and return the ones that are no longer held."""
+		for start, end, filename in self.writes[written:]:
+			held[:] = [item for item in held if not start <= item[0] < end]
+		released, kept = [], []
+		for item in held:
+			if self.start is None or item[0] < self.start:
+				released += [item]
+			else:
+				kept += [item]
+		held[:] = kept
+		return released
+
+	def open_name(self, i, name):
+		"""Start a new split for name, unless name already had one."""
+		if name not in self.seen:
+			self.write(self.start, i)
+			self.seen += [name]
+			self.start = i
+
+	def close(self, i):
+		self.write(self.start, i)
+		self.start = None
+
+	def close_at_incbin(self, i, line):
+		# dont absorb incbins
+		if 'base_emerald' in line and 'incbin' in line:
+			self.close(i)
+
+
+class MapScriptsSplitter(Splitter):
+	filename = 'data/maps/scripts/{}.s'
+	def feed(self, i, line, label):
 		if label:
 			if label.endswith('_MapScripts'):
-				name = label[len(g):-len('_MapScripts')]
-				if name not in seen:
-					write(start, i)
-					seen += [name]
-					start = i
+				self.open_name(i, label[len(g):-len('_MapScripts')])
 			elif (
 				'_EventScript_' not in label
 				and '_MapScript1_' not in label
 				and '_MapScript2_' not in label
-				and ((not seen) or (seen[-1] + '_' not in label))
+				and ((not self.seen) or (self.seen[-1] + '_' not in label))
 			):
-				write(start, i)
-				start = None
+				self.close(i)
 			# arbitrary stopping point
-			if version['version'] == 'emerald':
+			if self.version['version'] == 'emerald':
 				if '0x271315' in line:
-					break
-
-	split_stuff(root, writes)
-
-def split_map_text(version):
-	if version['version'] == 'emerald':
-		return
-
-	root = 'data/data1.s'
-
-	seen = []
-	def get_filename():
-		return 'data/maps/text/{}.s'.format(seen[-1])
-
-	writes = []
-	def write(start, end):
-		if start is not None:
-			writes.append((start, end, get_filename()))
-
-	start = None
-	for i, line in enumerate(open(root)):
-		label = get_label(line)
+					self.start = None
+					self.done = True
+
+class MapTextSplitter(Splitter):
+	filename = 'data/maps/text/{}.s'
+	def __init__(self, version):
+		Splitter.__init__(self, version)
+		self.done = version['version'] == 'emerald'
+	def feed(self, i, line, label):
 		if label:
 			if '_Text_' in label:
 				name = label[len(g):label.find('_Text_')]
-				if name not in seen:
-					write(start, i)
-					seen += [name]
-					start = i
-				elif seen and name != seen[-1]:
-					write(start, i)
-					start = None
+				if name not in self.seen:
+					self.open_name(i, name)
+				elif self.seen and name != self.seen[-1]:
+					self.close(i)
 			else:
-				write(start, i)
-				start = None
-		if version['version'] == 'ruby':
+				self.close(i)
+		if self.version['version'] == 'ruby':
 			if '0x19f7de' in line:
-				write(start, i)
-				start = None
-				#break
-
-	split_stuff(root, writes)
+				self.close(i)
 
-def split_map_assets():
+class RangeSplitter(Splitter):
+	"""One split, from the first label that matches to the first one after it that doesn't."""
 	root = 'data/data2.s'
-
-	start = None
-	enders = ('_MapBorder', '_MapBlockdata', '_MapAttributes')
-	for i, line in enumerate(open(root)):
-		label = get_label(line)
+	def matches(self, label):
+		return False
+	def get_filename(self):
+		return self.filename
+	def feed(self, i, line, label):
 		if label:
-			if any(map(label.endswith, enders)):
-				if start is None: start = i
-			elif start:
-				break
-	end = i
-	split_stuff(root, [(start, end, 'data/maps/_assets.s')])
+			if self.matches(label):
+				if self.start is None:
+					self.start = i
+			elif self.start is not None:
+				self.close(i)
+				self.done = True
+	def finish(self):
+		self.close(self.last)
+
+class MapAssetsSplitter(RangeSplitter):
+	filename = 'data/maps/_assets.s'
+	enders = ('_MapBorder', '_MapBlockdata', '_MapAttributes')
+	def matches(self, label):
+		return any(map(label.endswith, self.enders))
 
+class MapGroupsSplitter(RangeSplitter):
+	filename = 'data/maps/_groups.s'
+	def matches(self, label):
+		return label.startswith('gMapGroup')
 
-def split_map_events():
+class MapEventsSplitter(Splitter):
 	root = 'data/data2.s'
-
-	seen = []
-	def get_filename():
-		return 'data/maps/events/{}.s'.format(seen[-1])
-
-	writes = []
-	def write(start, end):
-		if start is not None:
-			writes.append((start, end, get_filename()))
-
-	start = None
+	filename = 'data/maps/events/{}.s'
 	enders = ('_MapObjects', '_MapWarps', '_MapCoordEvents', '_MapBGEvents', '_MapEvents')
-	for i, line in enumerate(open(root)):
-		label = get_label(line)
+	def feed(self, i, line, label):
 		if label:
-			for ender in enders:
+			for ender in self.enders:
 				if label.endswith(ender):
-					name = label.split(ender)[0][len(g):]
-					if name not in seen:
-						write(start, i)
-						seen += [name]
-						start = i
+					self.open_name(i, label.split(ender)[0][len(g):])
 					break
-		# dont absorb incbins
-		if 'base_emerald' in line and 'incbin' in line:
-			write(start, i)
-			start = None
-
-	split_stuff(root, writes)
+		self.close_at_incbin(i, line)
 
-
-def split_map_headers(version):
+class MapHeadersSplitter(Splitter):
 	root = 'data/data2.s'
-
-	seen = []
-	def get_filename():
-		return 'data/maps/{}/header.s'.format(seen[-1])
-
-	writes = []
-	def write(start, end):
-		if start is not None:
-			writes.append((start, end, get_filename()))
-
-	start = None
-	for i, line in enumerate(open(root)):
-		label = get_label(line)
+	filename = 'data/maps/{}/header.s'
+	def feed(self, i, line, label):
 		if label:
 			name = label[len(g):]
-			if name in version['map_names']:
-				if name not in seen:
-					write(start, i)
-					seen += [name]
-					start = i
+			if name in self.version['map_names']:
+				self.open_name(i, name)
 			else:
-				write(start, i)
-				start = None
-		# dont absorb incbins
-		if 'base_emerald' in line and 'incbin' in line:
-			write(start, i)
-			start = None
-
-	split_stuff(root, writes)
+				self.close(i)
+		self.close_at_incbin(i, line)
 
-
-def split_map_groups():
-	root = 'data/data2.s'
-
-	start = None
-	for i, line in enumerate(open(root)):
-		label = get_label(line)
-		if label:
-			if label.startswith('gMapGroup'):
-				if start is None: start = i
-			elif start is not None:
-				break
-	end = i
-	split_stuff(root, [(start, end, 'data/maps/_groups.s')])
-
-
-def split_map_connections():
+class MapConnectionsSplitter(Splitter):
 	root = 'data/data2.s'
-
-	seen = []
-	def get_filename():
-		return 'data/maps/{}/connections.s'.format(seen[-1])
-
-	writes = []
-	def write(start, end):
-		if start is not None:
-			writes.append((start, end, get_filename()))
-
-	start = None
+	filename = 'data/maps/{}/connections.s'
 	ender = '_MapConnectionsList'
-	for i, line in enumerate(open(root)):
-		label = get_label(line)
+	def feed(self, i, line, label):
 		if label:
-			if label.endswith(ender):
-				name = label.split(ender)[0][len(g):]
-				if name not in seen:
-					write(start, i)
-					seen += [name]
-					start = i
+			if label.endswith(self.ender):
+				self.open_name(i, label.split(self.ender)[0][len(g):])
 			elif not label.endswith('_MapConnections'):
-				write(start, i)
-				start = None
-		# dont absorb incbins
-		if 'base_emerald' in line and 'incbin' in line:
-			write(start, i)
-			start = None
-
-	split_stuff(root, writes)
-
-
-def main(version):
-	split_map_scripts(version)
-	split_map_assets()
-	split_map_events()
-	split_map_headers(version)
-	split_map_groups()
-	split_map_connections()
-	split_map_text(version)
+				self.close(i)
+		self.close_at_incbin(i, line)
+
+splitter_classes = [
+	MapScriptsSplitter,
+	MapAssetsSplitter,
+	MapEventsSplitter,
+	MapHeadersSplitter,
+	MapGroupsSplitter,
+	MapConnectionsSplitter,
+	MapTextSplitter,
+]
+
+
+def plan_splits(version, splitters=None):
+	"""
+	Read each root once, and run its splitters over it as a pipeline.
+	Returns [(root, lines, writes)], where writes are (start, end, filename).
+	"""
+	if splitters is None:
+		splitters = [class_(version) for class_ in splitter_classes]
+	roots = []
+	for splitter in splitters:
+		if splitter.root not in roots:
+			roots += [splitter.root]
+	plans = []
+	for root in roots:
+		if not os.path.exists(root):
+			continue
+		group = [splitter for splitter in splitters if splitter.root == root]
+		lines = open(root).readlines()
+		stream = ((i, line, get_label(line)) for i, line in enumerate(lines))
+		for splitter in group:
+			stream = splitter.run(stream)
+		for item in stream:
+			pass
+		writes = []
+		for splitter in group:
+			writes += splitter.writes
+		plans += [(root, lines, writes)]
+	return plans
+
+def render_splits(lines, writes, start=0, end=None):
+	"""
+	lines[start:end], with each outermost write replaced by an include of its file.
+	A split can contain earlier ones, which are included from it in turn.
+	Returns (text, {filename: text}).
+	"""
+	if end is None:
+		end = len(lines)
+	writes = sorted(writes, key=lambda write: (write[0], -write[1]))
+	text = []
+	files = {}
+	cursor = start
+	for i, (write_start, write_end, filename) in enumerate(writes):
+		if write_start < cursor:
+			continue
+		text += lines[cursor:write_start]
+		text += ['\t.include "{}"\n'.format(filename)]
+		inner = [write for write in writes[i + 1:] if write_end >= write[1] and write[0] < write_end]
+		files[filename], inner_files = render_splits(lines, inner, write_start, write_end)
+		files.update(inner_files)
+		cursor = write_end
+	text += lines[cursor:end]
+	return ''.join(text), files
+
+def report_splits(plans):
+	report = []
+	for root, lines, writes in plans:
+		report += ['{}: {} lines, {} splits'.format(root, len(lines), len(writes))]
+		for start, end, filename in sorted(writes):
+			report += ['\t{}-{} ({} lines) -> {}'.format(start + 1, end, end - start, filename)]
+	return '\n'.join(report)
+
+
+def main(version, dry_run=False):
+	plans = plan_splits(version)
+	if dry_run:
+		print report_splits(plans)
+		return
+	files = {}
+	roots = {}
+	for root, lines, writes in plans:
+		roots[root], root_files = render_splits(lines, writes)
+		files.update(root_files)
+	write_files(files.items())
+	for root, text in roots.items():
+		temp = root + '.tmp'
+		with open(temp, 'w') as out:
+			out.write(text)
+		os.rename(temp, root)
 
 if __name__ == '__main__':
-	main(versions.ruby)
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('version', nargs='?', default='ruby')
+	ap.add_argument('--dry-run', action='store_true', help='list the splits without writing anything')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+	main(versions.__dict__[args.version], args.dry_run)
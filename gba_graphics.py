@@ -0,0 +1,93 @@
+"""
+Decode gba tile graphics and palettes into arrays, and write them out as indexed pngs.
+
+	tiles = decode_4bpp(rom[address:address + size])
+	write_png('sprite.png', tiles_to_sheet(tiles, 4), decode_palette(rom[pal:pal + 32]))
+"""
+
+import struct
+import zlib
+
+import numpy as np
+
+tile_size = 8
+
+# A ramp to fall back on when a graphic has no known palette.
+grayscale_palette = np.repeat(np.arange(15, -1, -1, dtype=np.uint8) * 17, 3).reshape(16, 3)
+
+
+def decode_4bpp(data):
+	"""(tiles, 8, 8) color indices. The low nibble of each byte is the left pixel."""
+	data = np.frombuffer(bytes(data), dtype=np.uint8)
+	pixels = np.empty(len(data) * 2, dtype=np.uint8)
+	pixels[0::2] = data & 0xf
+	pixels[1::2] = data >> 4
+	return pixels.reshape(-1, tile_size, tile_size)
+
+def decode_8bpp(data):
+	data = np.frombuffer(bytes(data), dtype=np.uint8)
+	return data.reshape(-1, tile_size, tile_size)
+
+def encode_4bpp(tiles):
+	pixels = np.asarray(tiles, dtype=np.uint8).ravel()
+	return bytearray((pixels[0::2] & 0xf) | (pixels[1::2] << 4))
+
+def tiles_to_sheet(tiles, width=8):
+	"""Lay tiles out left to right, top to bottom, width tiles to a row. Short rows are padded with color 0."""
+	num_tiles = len(tiles)
+	width = max(min(width, num_tiles), 1)
+	height = -(-num_tiles // width)
+	padded = np.zeros((width * height, tile_size, tile_size), dtype=np.uint8)
+	padded[:num_tiles] = tiles
+	return padded.reshape(height, width, tile_size, tile_size).transpose(0, 2, 1, 3).reshape(height * tile_size, width * tile_size)
+
+def sheet_to_tiles(sheet):
+	height, width = sheet.shape[0] // tile_size, sheet.shape[1] // tile_size
+	return sheet.reshape(height, tile_size, width, tile_size).transpose(0, 2, 1, 3).reshape(-1, tile_size, tile_size)
+
+def decode_palette(data):
+	"""(colors, 3) rgb from bgr555. Each 5-bit channel is scaled up to 8 bits."""
+	colors = np.frombuffer(bytes(data), dtype='<u2')
+	channels = np.array([colors & 0x1f, (colors >> 5) & 0x1f, (colors >> 10) & 0x1f], dtype=np.uint8).T
+	return (channels << 3) | (channels >> 2)
+
+def encode_palette(rgb):
+	channels = np.asarray(rgb, dtype=np.uint16) >> 3
+	return bytearray((channels[:, 0] | (channels[:, 1] << 5) | (channels[:, 2] << 10)).astype('<u2').tostring())
+
+
+def png_chunk(kind, data):
+	return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+def encode_png(pixels, palette):
+	"""
+	A 2d array of color indices as the bytes of an indexed png.
+	Images with 16 colors or fewer are encoded at 4 bits per pixel.
+	"""
+	pixels = np.asarray(pixels, dtype=np.uint8)
+	palette = np.asarray(palette, dtype=np.uint8)
+	height, width = pixels.shape
+	if len(palette) <= 16:
+		depth = 4
+		if width % 2:
+			pixels = np.hstack([pixels, np.zeros((height, 1), dtype=np.uint8)])
+		rows = (pixels[:, 0::2] << 4) | (pixels[:, 1::2] & 0xf)
+	else:
+		depth = 8
+		rows = pixels
+	# Each row starts with filter type 0.
+	raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), rows])
+	return ''.join([
+		'\x89PNG\r\n\x1a\n',
+		png_chunk('IHDR', struct.pack('>IIBBBBB', width, height, depth, 3, 0, 0, 0)),
+		png_chunk('PLTE', palette.tostring()),
+		png_chunk('IDAT', zlib.compress(raw.tostring())),
+		png_chunk('IEND', ''),
+	])
+
+def write_png(filename, pixels, palette):
+	"""Write an indexed png (see encode_png), and return its bytes."""
+	data = encode_png(pixels, palette)
+	with open(filename, 'wb') as out:
+		out.write(data)
+	return data
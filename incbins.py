@@ -0,0 +1,189 @@
+"""
+An index of the baserom incbins left in a project, and how much of the rom
+they still hold.
+
+Each source file is read and scanned once, and kept with its size and mtime,
+so tools that walk the same files again (insert_chunks, dump_graphics) only
+re-read the ones that changed since.
+
+	$ python pret-agb/incbins.py
+	$ python pret-agb/incbins.py emerald --largest 40 --region-size 0x100000
+"""
+
+import os
+
+
+def parse_incbin(line):
+	"""(start, end) of a baserom incbin line. end is None for an incbin to the end of the rom."""
+	args = map(eval, line.split('@')[0].split(',')[1:3])
+	try:
+		start, length = args
+		return start, start + length
+	except ValueError:
+		return args[0], None
+
+def get_label_name(line):
+	code = line.split('@')[0].strip()
+	if code.endswith(':'):
+		return code.rstrip(':')
+	return None
+
+def scan_lines(lines, baserom_path):
+	"""
+	An entry for each line that matters, in order:
+	('include', i, path, None), ('incbin', i, start, end) or ('label', i, name, None).
+	"""
+	incbin = '.incbin "{path}"'.format(path=baserom_path)
+	entries = []
+	for i, line in enumerate(lines):
+		if '.include' in line:
+			entries += [('include', i, line.split('"')[1], None)]
+		elif incbin in line:
+			start, end = parse_incbin(line)
+			entries += [('incbin', i, start, end)]
+		else:
+			name = get_label_name(line)
+			if name:
+				entries += [('label', i, name, None)]
+	return entries
+
+
+class IncbinIndex(object):
+	def __init__(self, roots, baserom_path):
+		self.roots = list(roots)
+		self.baserom_path = baserom_path
+		self.files = {}
+
+	def get_stamp(self, path):
+		stat = os.stat(path)
+		return stat.st_size, stat.st_mtime
+
+	def get_file(self, path):
+		"""(lines, entries) for path, or None if it doesn't exist. Files are only re-read if they changed."""
+		if not os.path.exists(path):
+			self.files.pop(path, None)
+			return None
+		stamp = self.get_stamp(path)
+		cached = self.files.get(path)
+		if cached is None or cached[0] != stamp:
+			lines = open(path).readlines()
+			cached = self.files[path] = (stamp, lines, scan_lines(lines, self.baserom_path))
+		return cached[1], cached[2]
+
+	def update(self, path, text):
+		"""Note that text was just written to path."""
+		lines = text.splitlines(True)
+		self.files[path] = (self.get_stamp(path), lines, scan_lines(lines, self.baserom_path))
+
+	def walk(self, path):
+		"""(path, entries) for path and everything it includes, in include order."""
+		found = self.get_file(path)
+		if found is None:
+			return
+		lines, entries = found
+		yield path, entries
+		for kind, i, include, _ in entries:
+			if kind == 'include':
+				for item in self.walk(include):
+					yield item
+
+	def has_incbins(self, path):
+		return any(
+			kind == 'incbin'
+			for path_, entries in self.walk(path)
+			for kind, i, start, end in entries
+		)
+
+	def incbins(self, paths=None):
+		"""(path, line index, start, end) for every baserom incbin in paths (default: the roots) and their includes."""
+		for root in (self.roots if paths is None else paths):
+			for path, entries in self.walk(root):
+				for kind, i, start, end in entries:
+					if kind == 'incbin':
+						yield path, i, start, end
+
+	def spans(self, rom_size):
+		"""
+		(path, line index, start, end, label before, label after) for every incbin,
+		with the nearest labels around it in its file. Incbins to the end of the rom end at rom_size.
+		"""
+		spans = []
+		for root in self.roots:
+			for path, entries in self.walk(root):
+				before = None
+				waiting = []
+				for kind, i, a, b in entries:
+					if kind == 'label':
+						for span in waiting:
+							span[-1] = a
+						waiting = []
+						before = a
+					elif kind == 'incbin':
+						span = [path, i, a, rom_size if b is None else b, before, None]
+						spans += [span]
+						waiting += [span]
+		return map(tuple, spans)
+
+
+def get_inventory(index, rom_size, region_size=0x100000):
+	"""
+	What's left in incbins: the total, by file, by rom region, and every span largest first.
+	"""
+	spans = index.spans(rom_size)
+	by_file = {}
+	by_region = {}
+	for path, i, start, end, before, after in spans:
+		count, size = by_file.get(path, (0, 0))
+		by_file[path] = (count + 1, size + end - start)
+		address = start
+		while address < end:
+			region = address // region_size
+			region_end = min(end, (region + 1) * region_size)
+			by_region[region] = by_region.get(region, 0) + region_end - address
+			address = region_end
+	return {
+		'rom_size': rom_size,
+		'remaining': sum(size for count, size in by_file.values()),
+		'by_file': sorted(by_file.items(), key=lambda item: -item[1][1]),
+		'by_region': [(region * region_size, (region + 1) * region_size, size) for region, size in sorted(by_region.items())],
+		'spans': sorted(spans, key=lambda span: span[2] - span[3]),
+	}
+
+def print_inventory(inventory, largest=20):
+	rom_size, remaining = inventory['rom_size'], inventory['remaining']
+	done = rom_size - remaining
+	lines = ['0x{:x} of 0x{:x} bytes disassembled ({:.2f}%), 0x{:x} left in incbins'.format(
+		done, rom_size, 100. * done / rom_size if rom_size else 100., remaining
+	), '', 'by file:']
+	for path, (count, size) in inventory['by_file']:
+		lines += ['\t{}: 0x{:x} bytes in {} incbins'.format(path, size, count)]
+	lines += ['', 'by region:']
+	for start, end, size in inventory['by_region']:
+		lines += ['\t0x{:06x}-0x{:06x}: 0x{:x} bytes left ({:.1f}%)'.format(start, end, size, 100. * size / (end - start))]
+	lines += ['', 'largest:']
+	for path, i, start, end, before, after in inventory['spans'][:largest]:
+		lines += ['\t0x{:x}-0x{:x} (0x{:x}) {}:{} between {} and {}'.format(
+			start, end, end - start, path, i + 1, before or '(start)', after or '(end)'
+		)]
+	return '\n'.join(lines)
+
+
+def main():
+	from argparse import ArgumentParser
+	import profiling
+	import versions
+	ap = ArgumentParser()
+	ap.add_argument('version', nargs='?', default='ruby')
+	ap.add_argument('--largest', type=int, default=20, help='list this many of the largest incbins')
+	ap.add_argument('--region-size', type=lambda x: int(x, 0), default=0x100000)
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	version = versions.__dict__[args.version]
+	index = IncbinIndex(version['maps_paths'], version['baserom_path'])
+	rom_size = os.path.getsize(version['baserom_path']) if os.path.exists(version['baserom_path']) else 0
+	print print_inventory(get_inventory(index, rom_size, args.region_size), args.largest)
+
+if __name__ == '__main__':
+	main()
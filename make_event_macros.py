@@ -66,5 +66,15 @@ event_supplementary = """
 def get_event_macros():
 	return get_script_macros(event_commands) + '\n\n' + event_supplementary
 
-if __name__ == '__main__':
+def main():
+	from argparse import ArgumentParser
+	import profiling
+	ap = ArgumentParser()
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
 	print get_event_macros()
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,131 @@
+"""
+Map blockdata as arrays, for questions about every map at once.
+
+Each block is a 16-bit value:
+	bits 0-9    metatile id (0x000-0x1ff from the primary tileset, 0x200-0x3ff from the secondary)
+	bits 10-11  collision
+	bits 12-15  elevation
+
+	$ python pret-agb/map_blockdata.py --uses 0x1a3
+	$ python pret-agb/map_blockdata.py --unused
+"""
+
+import numpy as np
+
+from dump_maps import *
+import profiling
+
+metatile_mask = 0x3ff
+collision_shift, collision_mask = 10, 0x3
+elevation_shift, elevation_mask = 12, 0xf
+
+num_metatiles = 0x400
+num_primary_metatiles = 0x200
+
+
+def read_blocks(rom, address, width, height):
+	return np.frombuffer(rom, dtype='<u2', count=width * height, offset=address).reshape(height, width)
+
+class MapBlocks(object):
+	def __init__(self, name, attributes):
+		self.name = name
+		rom = attributes.rom
+		params = attributes.params
+		width, height = params['width'].value, params['height'].value
+		self.blocks = read_blocks(rom, params['blockdata_p'].real_address, width, height)
+		self.border = read_blocks(rom, params['border_p'].real_address, 2, 2)
+		self.tileset = attributes.chunks[4].real_address
+		self.tileset2 = attributes.chunks[5].real_address
+
+	@property
+	def metatiles(self):
+		return self.blocks & metatile_mask
+
+	@property
+	def collision(self):
+		return (self.blocks >> collision_shift) & collision_mask
+
+	@property
+	def elevation(self):
+		return (self.blocks >> elevation_shift) & elevation_mask
+
+	def metatile_usage(self):
+		return np.bincount(self.metatiles.ravel(), minlength=num_metatiles)
+
+
+def load_map_blocks(version):
+	"""MapBlocks for every map in gMapGroups, in group order."""
+	maps = []
+	for map_ in iter_maps(version):
+		name = get_map_name(version['map_groups'], map_.group, map_.num)
+		attributes = MapAttributes(
+			map_.params['attributes_p'].real_address,
+			group=map_.group, num=map_.num,
+			version=version, rom=version['baserom'],
+		)
+		maps += [MapBlocks(name, attributes)]
+	return maps
+
+def get_usage(maps):
+	"""A (maps x metatiles) array of how many times each map uses each metatile."""
+	return np.array([map_.metatile_usage() for map_ in maps])
+
+def get_maps_using(maps, metatile, usage=None):
+	if usage is None:
+		usage = get_usage(maps)
+	return [maps[i].name for i in np.flatnonzero(usage[:, metatile])]
+
+def get_unused_metatiles(maps, usage=None):
+	"""
+	For each tileset, the metatile ids that no map using it refers to.
+	Primary tilesets own ids below 0x200 and secondary tilesets the rest.
+	"""
+	if usage is None:
+		usage = get_usage(maps)
+	unused = {}
+	for key, ids in (('tileset', slice(0, num_primary_metatiles)), ('tileset2', slice(num_primary_metatiles, num_metatiles))):
+		tilesets = np.array([getattr(map_, key) for map_ in maps])
+		for tileset in np.unique(tilesets):
+			used = usage[tilesets == tileset, ids].sum(axis=0)
+			unused[int(tileset)] = np.flatnonzero(used == 0) + ids.start
+	return unused
+
+def get_collision_summary(maps):
+	"""(name, width, height, impassable blocks) for each map."""
+	return [
+		(map_.name, map_.blocks.shape[1], map_.blocks.shape[0], int(np.count_nonzero(map_.collision)))
+		for map_ in maps
+	]
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('version', nargs='?', default='ruby')
+	ap.add_argument('--uses', type=lambda x: int(x, 0), help='list maps that use this metatile id')
+	ap.add_argument('--unused', action='store_true', help='list unused metatile ids per tileset')
+	ap.add_argument('--top', type=int, default=0, help='list the most used metatile ids')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	version = get_setup_version(args.version)
+	maps = load_map_blocks(version)
+	usage = get_usage(maps)
+
+	if args.uses is not None:
+		for name in get_maps_using(maps, args.uses, usage):
+			print name
+	if args.unused:
+		for tileset, ids in sorted(get_unused_metatiles(maps, usage).items()):
+			print '0x{:x}: {}'.format(tileset, ' '.join('0x{:03x}'.format(int(i)) for i in ids))
+	if args.top:
+		total = usage.sum(axis=0)
+		for metatile in np.argsort(total)[::-1][:args.top]:
+			print '0x{:03x}: {}'.format(int(metatile), total[metatile])
+	if args.uses is None and not args.unused and not args.top:
+		for name, width, height, impassable in get_collision_summary(maps):
+			print '{}: {}x{}, {} impassable'.format(name, width, height, impassable)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,228 @@
+"""
+Every map, and how the player gets from one to another: by walking off the
+edge of a map (connections), or through a door or stairs (warps).
+
+The graph is built from one pass over the map headers and kept as adjacency
+arrays (compressed sparse rows), so queries don't need the rom again.
+It's saved next to the project and reused as long as the rom and map names match.
+
+	$ python pret-agb/map_graph.py --path LittlerootTown EverGrandeCity
+	$ python pret-agb/map_graph.py --reachable PetalburgCity
+	$ python pret-agb/map_graph.py --dot maps.dot
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from dump_maps import *
+import profiling
+
+CONNECTION = 0
+WARP = 1
+edge_kinds = ['connection', 'warp']
+
+
+def read_map_edges(map_):
+	"""(kind, group, num, detail) for each connection and warp out of map_. detail is the direction, or the warp id."""
+	rom, version = map_.rom, map_.version
+	edges = []
+	connections_p = map_.chunks[3]
+	if connections_p.real_address:
+		connections = MapConnections(connections_p.real_address, version=version, rom=rom)
+		pointer = connections.params['pointer']
+		if pointer.real_address:
+			for connection in MapConnectionsList(pointer.real_address, count=pointer.count, version=version, rom=rom).chunks:
+				map_id = connection.params['map'].params
+				edges += [(CONNECTION, map_id['group'].value, map_id['number'].value, connection.params['direction'].asm)]
+	events_p = map_.chunks[1]
+	if events_p.real_address:
+		warps_p = MapEvents(events_p.real_address, version=version, rom=rom).chunks[5]
+		if warps_p.real_address:
+			for warp in MapWarps(warps_p.real_address, count=warps_p.count, version=version, rom=rom).chunks:
+				map_id = warp.params['map'].params
+				edges += [(WARP, map_id['group'].value, map_id['number'].value, warp.params['warp'].value)]
+	return edges
+
+
+class MapGraph(object):
+	"""
+	Maps are nodes, numbered in gMapGroups order. Edges out of node i are
+	indptr[i]:indptr[i + 1] in targets, kinds and details.
+	"""
+	def __init__(self, names, keys, sources, targets, kinds, details, digest=None):
+		self.digest = digest
+		self.names = list(names)
+		self.keys = [tuple(key) for key in keys]
+		self.index = {name: i for i, name in enumerate(self.names)}
+		sources = np.asarray(sources, dtype=np.int32)
+		order = np.argsort(sources, kind='mergesort')
+		self.targets = np.asarray(targets, dtype=np.int32)[order]
+		self.kinds = np.asarray(kinds, dtype=np.int8)[order]
+		self.details = np.asarray(details, dtype=str)[order]
+		self.indptr = np.concatenate([[0], np.cumsum(np.bincount(sources, minlength=len(self.names)))])
+
+	@classmethod
+	def from_version(cls, version):
+		maps = list(iter_maps(version))
+		keys = [(map_.group, map_.num) for map_ in maps]
+		names = [get_map_name(version['map_groups'], group, num) for group, num in keys]
+		node = {key: i for i, key in enumerate(keys)}
+		sources, targets, kinds, details = [], [], [], []
+		for i, map_ in enumerate(maps):
+			for kind, group, num, detail in read_map_edges(map_):
+				# Dynamic warps (0x7f) and ids that aren't maps aren't edges.
+				if (group, num) not in node:
+					continue
+				sources += [i]
+				targets += [node[(group, num)]]
+				kinds += [kind]
+				details += [str(detail)]
+		return cls(names, keys, sources, targets, kinds, details)
+
+	def get_node(self, name_or_index):
+		if isinstance(name_or_index, basestring):
+			if name_or_index not in self.index:
+				raise KeyError('unknown map {}'.format(name_or_index))
+			return self.index[name_or_index]
+		return name_or_index
+
+	def neighbors(self, node, kinds=(CONNECTION, WARP)):
+		node = self.get_node(node)
+		start, end = self.indptr[node], self.indptr[node + 1]
+		mask = np.in1d(self.kinds[start:end], kinds)
+		return self.targets[start:end][mask]
+
+	def bfs(self, source, kinds=(CONNECTION, WARP)):
+		"""The parent of every node on a shortest path from source, or -1 if it can't be reached."""
+		source = self.get_node(source)
+		parents = np.full(len(self.names), -1, dtype=np.int32)
+		parents[source] = source
+		frontier = [source]
+		while frontier:
+			next_frontier = []
+			for node in frontier:
+				for target in self.neighbors(node, kinds):
+					if parents[target] == -1:
+						parents[target] = node
+						next_frontier += [target]
+			frontier = next_frontier
+		return parents
+
+	def shortest_path(self, source, target, kinds=(CONNECTION, WARP)):
+		"""Map names from source to target, or None if there is no way there."""
+		target = self.get_node(target)
+		parents = self.bfs(source, kinds)
+		if parents[target] == -1:
+			return None
+		path = [target]
+		while parents[path[-1]] != path[-1]:
+			path += [parents[path[-1]]]
+		return [self.names[node] for node in reversed(path)]
+
+	def reachable(self, source, kinds=(CONNECTION, WARP)):
+		parents = self.bfs(source, kinds)
+		return [self.names[node] for node in np.flatnonzero(parents != -1)]
+
+	def edges(self):
+		"""(source name, target name, kind, detail) for every edge."""
+		for node, name in enumerate(self.names):
+			for i in xrange(self.indptr[node], self.indptr[node + 1]):
+				yield name, self.names[self.targets[i]], edge_kinds[self.kinds[i]], self.details[i]
+
+	def to_json(self):
+		return json.dumps({
+			'maps': [{'name': name, 'group': group, 'num': num} for name, (group, num) in zip(self.names, self.keys)],
+			'edges': [
+				{'from': source, 'to': target, 'kind': kind, 'detail': detail}
+				for source, target, kind, detail in self.edges()
+			],
+		}, indent=1)
+
+	def to_dot(self):
+		lines = ['digraph maps {']
+		for source, target, kind, detail in self.edges():
+			style = '' if kind == 'connection' else ' style=dashed'
+			lines += ['\t"{}" -> "{}" [label="{}"{}];'.format(source, target, detail, style)]
+		lines += ['}']
+		return '\n'.join(lines) + '\n'
+
+	def save(self, path):
+		sources = np.repeat(np.arange(len(self.names)), np.diff(self.indptr))
+		with open(path, 'wb') as out:
+			np.savez(
+				out, names=np.asarray(self.names, dtype=str), keys=np.asarray(self.keys),
+				sources=sources, targets=self.targets, kinds=self.kinds, details=self.details,
+				digest=str(self.digest),
+			)
+
+	@classmethod
+	def load(cls, path):
+		data = np.load(path)
+		return cls(data['names'], data['keys'], data['sources'], data['targets'], data['kinds'], data['details'], str(data['digest']))
+
+
+def get_default_path(version_name):
+	return '.pret-agb-map-graph.{}.npz'.format(version_name)
+
+def get_digest(version):
+	"""A hash of what the graph is built from: the rom, and the constants maps are named by."""
+	digest = hashlib.sha1()
+	for path in [version['baserom_path'], 'constants/map_constants.s']:
+		digest.update(open(path, 'rb').read())
+	return digest.hexdigest()
+
+def get_graph(version_name='ruby', path=None, rebuild=False):
+	"""
+	Load the saved graph for a version, or build and save it.
+	The version is only set up if the graph has to be built.
+	"""
+	if path is None:
+		path = get_default_path(version_name)
+	digest = get_digest(versions.__dict__[version_name])
+	if os.path.exists(path) and not rebuild:
+		graph = MapGraph.load(path)
+		if graph.digest == digest:
+			return graph
+	graph = MapGraph.from_version(get_setup_version(version_name))
+	graph.digest = digest
+	graph.save(path)
+	return graph
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('version', nargs='?', default='ruby')
+	ap.add_argument('--path', nargs=2, metavar=('FROM', 'TO'), help='the fewest maps from one map to another')
+	ap.add_argument('--reachable', metavar='FROM', help='list maps that can be reached from this one')
+	ap.add_argument('--connections-only', action='store_true', help='ignore warps')
+	ap.add_argument('--json', metavar='FILE')
+	ap.add_argument('--dot', metavar='FILE')
+	ap.add_argument('--cache', metavar='FILE', help='where the graph is saved (default: .pret-agb-map-graph.VERSION.npz)')
+	ap.add_argument('--rebuild', action='store_true', help='build the graph again even if the saved one matches')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	graph = get_graph(args.version, args.cache, args.rebuild)
+	kinds = (CONNECTION,) if args.connections_only else (CONNECTION, WARP)
+
+	if args.path:
+		path = graph.shortest_path(args.path[0], args.path[1], kinds)
+		print ' -> '.join(path) if path else 'no path'
+	if args.reachable:
+		for name in graph.reachable(args.reachable, kinds):
+			print name
+	if args.json:
+		open(args.json, 'w').write(graph.to_json())
+	if args.dot:
+		open(args.dot, 'w').write(graph.to_dot())
+	if not (args.path or args.reachable or args.json or args.dot):
+		for source, target, kind, detail in graph.edges():
+			print '{} -> {} ({} {})'.format(source, target, kind, detail)
+
+if __name__ == '__main__':
+	main()
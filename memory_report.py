@@ -0,0 +1,237 @@
+"""
+What a parse keeps in memory, and where.
+
+Each chunk is sized on its own: the instance, its __dict__, the lists and dicts
+it holds (child lists, params), strings, and rom data it keeps a slice of
+(BinFile.value, decompressed data). Chunks it points to or contains are sized
+as chunks of their own, and the rom and version it shares with every other
+chunk aren't counted at all. Sizes are broken down by chunk class and by root.
+
+Snapshots at each stage of the pipeline show how resident memory and live
+objects grow from one stage to the next. Rendering is measured that way too,
+since the asm it makes is only held until it's written out.
+
+	$ python pret-agb/memory_report.py --render
+	$ python pret-agb/memory_report.py --root EventScript 1b6e63 --top 20
+"""
+
+from collections import Counter, defaultdict
+import gc
+import json
+import os
+import resource
+import sys
+
+from script import *
+import profiling
+
+categories = ['instance', 'dict', 'children', 'strings', 'rom_data', 'other']
+child_keys = ['chunks', 'pointers', 'params']
+
+
+def get_rss():
+	"""Resident memory of this process now, in kB, or the peak if that's all there is."""
+	try:
+		pages = int(open('/proc/self/statm').read().split()[1])
+		return pages * os.sysconf('SC_PAGE_SIZE') // 1024
+	except (IOError, OSError, ValueError):
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def get_chunk_size(chunk, shared=()):
+	"""{category: bytes} held by chunk itself. shared is ids of objects not to count."""
+	sizes = Counter()
+	sizes['instance'] += sys.getsizeof(chunk)
+	sizes['dict'] += sys.getsizeof(chunk.__dict__)
+	for key, value in chunk.__dict__.items():
+		if id(value) in shared or isinstance(value, (Chunk, type)):
+			continue
+		if isinstance(value, bytearray):
+			sizes['rom_data'] += sys.getsizeof(value)
+		elif isinstance(value, basestring):
+			sizes['strings'] += sys.getsizeof(value)
+		elif isinstance(value, (list, tuple, dict)):
+			items = value.values() if isinstance(value, dict) else value
+			if key in child_keys or any(isinstance(item, Chunk) for item in items):
+				sizes['children'] += sys.getsizeof(value)
+			else:
+				sizes['other'] += sys.getsizeof(value) + sum(
+					sys.getsizeof(item) for item in items
+					if id(item) not in shared and not isinstance(item, type)
+				)
+		else:
+			sizes['other'] += sys.getsizeof(value)
+	return sizes
+
+def get_shared(version):
+	"""Ids of objects every chunk holds a reference to, but none owns."""
+	shared = set([id(version), id(version.get('baserom'))])
+	shared.update(id(value) for value in version.values())
+	return shared
+
+def iter_nested(chunks):
+	"""Each chunk in chunks and everything nested in them, once."""
+	seen = set()
+	nested = list(chunks)
+	while nested:
+		chunk = nested.pop()
+		if id(chunk) in seen:
+			continue
+		seen.add(id(chunk))
+		yield chunk
+		nested += chunk.chunks
+		label = getattr(chunk, 'label', None)
+		if isinstance(label, Chunk):
+			nested += [label]
+
+
+class MemoryReport(object):
+	def __init__(self, version):
+		self.version = version
+		self.shared = get_shared(version)
+		self.by_class = defaultdict(Counter)
+		self.counts = Counter()
+		self.by_root = []
+		self.snapshots = []
+
+	def add_chunks(self, chunks):
+		for chunk in iter_nested(chunks):
+			name = chunk.__class__.__name__
+			self.counts[name] += 1
+			self.by_class[name].update(get_chunk_size(chunk, self.shared))
+
+	def add_roots(self, roots, visited):
+		"""
+		Size what each root reaches. Chunks reached from more than one root
+		are counted in each root's total, but only in exclusive for one.
+		"""
+		reached = []
+		owners = Counter()
+		for root in roots:
+			chunks = list(iter_nested(get_reachable(visited, root[1])))
+			reached += [chunks]
+			owners.update(set(id(chunk) for chunk in chunks))
+		for root, chunks in zip(roots, reached):
+			total = exclusive = 0
+			for chunk in chunks:
+				size = sum(get_chunk_size(chunk, self.shared).values())
+				total += size
+				if owners[id(chunk)] == 1:
+					exclusive += size
+			self.by_root += [{
+				'root': '{} 0x{:x}'.format(root[0].__name__, root[1]),
+				'chunks': len(chunks),
+				'total': total,
+				'exclusive': exclusive,
+			}]
+
+	def snapshot(self, stage, **extra):
+		"""Note resident memory and live objects (by type) at the end of a stage, and anything extra about it."""
+		gc.collect()
+		objects = gc.get_objects()
+		self.snapshots += [dict(extra, **{
+			'stage': stage,
+			'rss_kb': get_rss(),
+			'objects': len(objects),
+			'types': Counter(type(o).__name__ for o in objects),
+		})]
+
+	def get_stages(self, top=5):
+		"""Each snapshot, with how much it grew from the last one and the types that grew most."""
+		stages = []
+		previous = None
+		for snapshot in self.snapshots:
+			stage = {key: value for key, value in snapshot.items() if key != 'types'}
+			if previous:
+				stage['rss_kb_change'] = snapshot['rss_kb'] - previous['rss_kb']
+				stage['objects_change'] = snapshot['objects'] - previous['objects']
+				types = snapshot['types'].copy()
+				types.subtract(previous['types'])
+				stage['grew'] = [(name, count) for name, count in types.most_common(top) if count > 0]
+			stages += [stage]
+			previous = snapshot
+		return stages
+
+	def to_dict(self):
+		return {
+			'classes': {
+				name: dict(sizes, count=self.counts[name], total=sum(sizes.values()))
+				for name, sizes in self.by_class.items()
+			},
+			'roots': self.by_root,
+			'stages': self.get_stages(),
+		}
+
+	def report(self, top=30):
+		lines = []
+		for stage in self.get_stages():
+			line = '{}: {} kB rss, {} objects'.format(stage['stage'], stage['rss_kb'], stage['objects'])
+			if 'rss_kb_change' in stage:
+				line += ' ({:+} kB, {:+} objects: {})'.format(
+					stage['rss_kb_change'], stage['objects_change'],
+					', '.join('{} {:+}'.format(name, count) for name, count in stage['grew']),
+				)
+			if 'output_bytes' in stage:
+				line += ', holding {} bytes of output'.format(stage['output_bytes'])
+			lines += [line]
+		lines += ['']
+		shown = categories
+		lines += ['{:<32} {:>8} {:>10} '.format('class', 'count', 'total') + ' '.join('{:>9}'.format(c[:9]) for c in shown)]
+		totals = sorted(self.by_class.items(), key=lambda item: -sum(item[1].values()))
+		for name, sizes in totals[:top]:
+			lines += ['{:<32} {:>8} {:>10} '.format(name[:32], self.counts[name], sum(sizes.values())) + ' '.join('{:>9}'.format(sizes[c]) for c in shown)]
+		everything = Counter()
+		for sizes in self.by_class.values():
+			everything.update(sizes)
+		lines += ['{:<32} {:>8} {:>10} '.format('all', sum(self.counts.values()), sum(everything.values())) + ' '.join('{:>9}'.format(everything[c]) for c in shown)]
+		if self.by_root:
+			lines += ['']
+			for root in sorted(self.by_root, key=lambda root: -root['total'])[:top]:
+				lines += ['{root}: {chunks} chunks, {total} bytes ({exclusive} only from here)'.format(**root)]
+		return '\n'.join(lines)
+
+
+def measure(roots, version, render=False):
+	"""Parse roots and flatten them as a dump would, and report on it all."""
+	report = MemoryReport(version)
+	report.snapshot('setup')
+	visited = recursive_parse_all(roots, version=version, rom=version['baserom'])
+	report.snapshot('parse')
+	chunks = flatten_nested_chunks(visited.values())
+	report.snapshot('flatten')
+	resolve_labels(chunks, version)
+	report.snapshot('labels')
+	if render:
+		asm = print_chunks(chunks)
+		report.snapshot('render', output_bytes=len(asm))
+		del asm
+		report.snapshot('rendered')
+	report.add_chunks(visited.values())
+	report.add_roots(roots, visited)
+	return report
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('version', nargs='?', default='ruby')
+	ap.add_argument('--root', nargs=2, action='append', default=[], metavar=('CLASS', 'ADDRESS'), help='parse from here (default: gMapGroups)')
+	ap.add_argument('--render', action='store_true', help='also render the asm, and measure memory while it\'s held and after')
+	ap.add_argument('--top', type=int, default=30)
+	ap.add_argument('--json', metavar='FILE')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	version = get_setup_version(args.version)
+	classes = get_classes()
+	roots = [(classes[name], int(address, 16)) for name, address in args.root]
+	if not roots:
+		roots = [(classes['MapGroups'], version['map_groups_address'])]
+	report = measure(roots, version, args.render)
+	print report.report(args.top)
+	if args.json:
+		with open(args.json, 'w') as out:
+			json.dump(report.to_dict(), out, indent=1, sort_keys=True)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,168 @@
+"""
+Record the pointer graph that recursive_parse walks, and summarize it.
+
+Each pointer followed is an edge, from the chunk that holds it to the one it
+points at, in the order it was found. Pointers to chunks that were already
+parsed are edges too, marked as not new. Each chunk parsed is a node, with its
+own parse time and the time for everything first parsed under it.
+
+The trace is streamed as json lines, so it can be read while a parse is still going.
+
+	$ python pret-agb/parse_trace.py record MapGroups 308588 -o maps.trace
+	$ python pret-agb/parse_trace.py summary maps.trace --top 20
+"""
+
+from collections import Counter, defaultdict
+import json
+import sys
+
+from script import *
+import profiling
+
+
+def get_arg(value):
+	if isinstance(value, (int, long, float, basestring, bool)) or value is None:
+		return value
+	if isinstance(value, type):
+		return value.__name__
+	return repr(value)
+
+class ParseTracer(object):
+	"""Writes edges and nodes from recursive_parse_all to out, one json object per line."""
+	def __init__(self, out):
+		self.out = out
+		self.order = 0
+
+	def write(self, item):
+		self.out.write(json.dumps(item, separators=(',', ':')) + '\n')
+
+	def edge(self, source, pointer, target_args, depth, new):
+		self.write({
+			'type': 'edge',
+			'order': self.order,
+			'depth': depth,
+			'source': [source.__class__.__name__, source.address],
+			'pointer': pointer.address,
+			'target': [pointer.target.__name__, pointer.real_address],
+			'args': {key: get_arg(value) for key, value in target_args.items()},
+			'new': new,
+		})
+		self.order += 1
+
+	def node(self, chunk, depth, seconds, subtree_seconds):
+		self.write({
+			'type': 'node',
+			'class': chunk.__class__.__name__,
+			'address': chunk.address,
+			'depth': depth,
+			'seconds': seconds,
+			'subtree_seconds': subtree_seconds,
+		})
+
+def record(roots, version, out):
+	return recursive_parse_all(roots, tracer=ParseTracer(out), version=version, rom=version['baserom'])
+
+
+def read_trace(lines):
+	for line in lines:
+		if line.strip():
+			yield json.loads(line)
+
+def summarize(items, top=10):
+	"""Fan-out, fan-in, depths and the slowest subtrees and classes in a trace."""
+	fan_out = Counter()
+	fan_in = Counter()
+	new_edges = revisits = 0
+	depths = Counter()
+	class_seconds = defaultdict(float)
+	class_counts = Counter()
+	nodes = []
+	for item in items:
+		if item['type'] == 'edge':
+			fan_out[tuple(item['source'])] += 1
+			fan_in[tuple(item['target'])] += 1
+			if item['new']:
+				new_edges += 1
+			else:
+				revisits += 1
+		elif item['type'] == 'node':
+			depths[item['depth']] += 1
+			class_seconds[item['class']] += item['seconds']
+			class_counts[item['class']] += 1
+			nodes += [item]
+	nodes.sort(key=lambda node: -node['subtree_seconds'])
+	return {
+		'nodes': len(nodes),
+		'edges': new_edges + revisits,
+		'new_edges': new_edges,
+		'revisits': revisits,
+		'depths': sorted(depths.items()),
+		'fan_out': Counter(fan_out.values()).most_common(),
+		'most_pointers': [(name, address, count) for (name, address), count in fan_out.most_common(top)],
+		'most_referenced': [(name, address, count) for (name, address), count in fan_in.most_common(top)],
+		'slowest_subtrees': [
+			(node['class'], node['address'], node['subtree_seconds'], node['seconds'])
+			for node in nodes[:top]
+		],
+		'slowest_classes': [
+			(name, class_counts[name], seconds)
+			for name, seconds in sorted(class_seconds.items(), key=lambda item: -item[1])[:top]
+		],
+	}
+
+def print_summary(summary):
+	lines = [
+		'{nodes} chunks, {edges} pointers ({new_edges} to new chunks, {revisits} to parsed ones)'.format(**summary),
+		'',
+		'depth: chunks',
+	]
+	most = max([count for depth, count in summary['depths']] or [1])
+	for depth, count in summary['depths']:
+		lines += ['{:>5}: {:>7} {}'.format(depth, count, '#' * int(round(40. * count / most)))]
+	lines += ['', 'pointers per chunk: chunks']
+	for pointers, count in sorted(summary['fan_out']):
+		lines += ['{:>5}: {:>7}'.format(pointers, count)]
+	lines += ['', 'most pointers:']
+	lines += ['\t{} 0x{:x}: {}'.format(*item) for item in summary['most_pointers']]
+	lines += ['', 'most referenced:']
+	lines += ['\t{} 0x{:x}: {}'.format(*item) for item in summary['most_referenced']]
+	lines += ['', 'slowest subtrees:']
+	lines += ['\t{} 0x{:x}: {:.4f}s ({:.4f}s itself)'.format(*item) for item in summary['slowest_subtrees']]
+	lines += ['', 'slowest classes:']
+	lines += ['\t{}: {} parsed in {:.4f}s'.format(*item) for item in summary['slowest_classes']]
+	return '\n'.join(lines)
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('command', choices=['record', 'summary'])
+	ap.add_argument('args', nargs='+', help='CLASS ADDRESS [...] to record, or a trace to summarize')
+	ap.add_argument('--version', default='ruby')
+	ap.add_argument('-o', '--output', help='write the trace here (default: stdout)')
+	ap.add_argument('--top', type=int, default=10)
+	ap.add_argument('--json', action='store_true', help='print the summary as json')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	if args.command == 'record':
+		if len(args.args) % 2:
+			ap.error('record takes pairs of class name and address')
+		classes = get_classes()
+		roots = [(classes[name], int(address, 16)) for name, address in zip(args.args[::2], args.args[1::2])]
+		out = open(args.output, 'w') if args.output else sys.stdout
+		try:
+			record(roots, get_setup_version(args.version), out)
+		finally:
+			if args.output:
+				out.close()
+	elif args.command == 'summary':
+		summary = summarize(read_trace(open(args.args[0])), args.top)
+		if args.json:
+			print json.dumps(summary, indent=1)
+		else:
+			print print_summary(summary)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,121 @@
+"""
+Find pointer tables anywhere in the rom, all at once.
+
+The rom is viewed as an array of aligned words, and every word that points
+into the rom is marked. Runs of marked words (every word, or every 2nd or 3rd
+word for tables of structs) become candidate tables, classified by what
+their targets look like and ranked by size and consistency.
+
+	$ python pret-agb/pointer_scan.py --min-count 8 | head
+"""
+
+import numpy as np
+
+from script import get_setup_version
+from compression import compressed_file_classes
+import profiling
+
+rom_start = 0x8000000
+rom_end = 0x9ffffff
+
+
+class PointerScan(object):
+	def __init__(self, rom):
+		self.rom = np.frombuffer(bytes(rom), dtype=np.uint8)
+		self.words = np.frombuffer(self.rom.data, dtype='<u4', count=len(self.rom) // 4)
+		targets = self.words.astype(np.int64) - rom_start
+		self.is_pointer = (self.words >= rom_start) & (self.words <= rom_end) & (targets < len(self.rom))
+		self.targets = np.where(self.is_pointer, targets, 0)
+
+	def runs(self, stride=1, min_count=4):
+		"""
+		(address, count) for each run of at least min_count pointers spaced stride words apart.
+		For strides over 1, the word after each pointer must not be a pointer,
+		so plain pointer lists aren't reported again as tables of structs.
+		"""
+		is_pointer = self.is_pointer
+		if stride > 1:
+			is_pointer = is_pointer & ~np.append(is_pointer[1:], False)
+		runs = []
+		for offset in xrange(stride):
+			mask = is_pointer[offset::stride].astype(np.int8)
+			edges = np.diff(np.concatenate([[0], mask, [0]]))
+			starts = np.flatnonzero(edges == 1)
+			ends = np.flatnonzero(edges == -1)
+			keep = ends - starts >= min_count
+			for start, end in zip(starts[keep], ends[keep]):
+				runs += [((offset + start * stride) * 4, int(end - start))]
+		return sorted(runs)
+
+	def covers(self, start, end, stride=1):
+		"""Whether every stride-th word from start up to end is a pointer."""
+		words = self.is_pointer[start // 4:end // 4:stride]
+		return len(words) > 0 and bool(words.all())
+
+	def classify(self, address, count, stride=1):
+		"""
+		Guess what a table points at. Returns (kind, fraction of targets that fit):
+		the first kind that fits at least 90% of targets, or else whichever fits most.
+		"""
+		index = address // 4
+		values = self.words[index:index + count * stride:stride]
+		targets = (values - rom_start).astype(np.int64)
+		aligned = targets % 4 == 0
+		rom = self.rom
+		before = rom[np.maximum(targets - 1, 0)]
+		tests = [
+			('code', values & 1 == 1),
+			('compressed', np.in1d(rom[targets], compressed_file_classes.keys()) & aligned),
+		]
+		if stride == 2:
+			# ObjTiles are (pointer, size, tag) and ObjPals are (pointer, tag, 0).
+			low = self.words[index + 1:index + count * 2:2] & 0xffff
+			high = self.words[index + 1:index + count * 2:2] >> 16
+			tests += [
+				('obj_tiles', aligned & (low > 0) & (low % 32 == 0) & (high > 0)),
+				('obj_pal', aligned & (low > 0) & (high == 0)),
+			]
+		tests += [
+			# Strings and scripts are packed end to end, so the byte before
+			# one is the end of the last: 0xff for text, end or return for scripts.
+			('text', before == 0xff),
+			('script', (before == 0x02) | (before == 0x03)),
+			('data', aligned),
+		]
+		fractions = [(kind, float(np.count_nonzero(fits)) / count) for kind, fits in tests]
+		for kind, fraction in fractions:
+			if fraction >= 0.9:
+				return kind, fraction
+		return max(fractions, key=lambda item: item[1])
+
+	def candidates(self, strides=(1, 2, 3), min_count=4):
+		"""
+		(score, address, count, stride, kind) for every run, best first.
+		The score favours long tables whose targets agree on a kind.
+		"""
+		found = []
+		for stride in strides:
+			for address, count in self.runs(stride, min_count):
+				kind, fraction = self.classify(address, count, stride)
+				found += [(count * fraction, address, count, stride, kind)]
+		return sorted(found, reverse=True)
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('version', nargs='?', default='ruby')
+	ap.add_argument('--min-count', type=int, default=4)
+	ap.add_argument('--kind')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+	version = get_setup_version(args.version)
+	scan = PointerScan(version['baserom'])
+	for score, address, count, stride, kind in scan.candidates(min_count=args.min_count):
+		if args.kind and kind != args.kind:
+			continue
+		print '0x{:06x}: {} x{} (stride {}) score {:.1f}'.format(address, kind, count, stride, score)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,226 @@
+"""
+Count where a run spends its time: constructions and parse time per chunk
+class, to_asm renders, rom bytes read, label lookups and files opened.
+
+Nothing is touched until a Profile is enabled, so there's no cost otherwise.
+Every command line tool takes --profile (a report on stderr) and
+--profile-json FILE.
+
+	$ python pret-agb/dump_maps.py --profile --workers 1
+"""
+
+import __builtin__
+import atexit
+from collections import Counter, defaultdict
+import json
+import os
+import sys
+import time
+
+current = None
+
+
+class CountingRom(bytearray):
+	"""A rom that counts the bytes read from it."""
+	def __init__(self, rom, profile):
+		bytearray.__init__(self, rom)
+		self.profile = profile
+	def __getitem__(self, index):
+		value = bytearray.__getitem__(self, index)
+		self.profile.rom_bytes += len(value) if isinstance(index, slice) else 1
+		return value
+	def find(self, sub, start=0, *args):
+		found = bytearray.find(self, sub, start, *args)
+		self.profile.rom_bytes += (found if found != -1 else len(self)) - start + len(sub)
+		return found
+
+class CountingLabels(dict):
+	"""Labels that count lookups, and how many found a label."""
+	def __init__(self, labels, profile):
+		dict.__init__(self, labels)
+		self.profile = profile
+	def lookup(self, key):
+		self.profile.label_lookups += 1
+		if dict.__contains__(self, key):
+			self.profile.label_hits += 1
+			return True
+		return False
+	def get(self, key, default=None):
+		if self.lookup(key):
+			return dict.__getitem__(self, key)
+		return default
+	def __getitem__(self, key):
+		self.lookup(key)
+		return dict.__getitem__(self, key)
+	def __contains__(self, key):
+		return self.lookup(key)
+
+
+def get_chunk_classes(class_):
+	classes = [class_]
+	for subclass in class_.__subclasses__():
+		classes += get_chunk_classes(subclass)
+	return classes
+
+class Profile(object):
+	def __init__(self):
+		self.constructions = Counter()
+		self.parse_seconds = defaultdict(float)
+		self.parse_self_seconds = defaultdict(float)
+		self.renders = Counter()
+		self.rom_bytes = 0
+		self.label_lookups = 0
+		self.label_hits = 0
+		self.file_opens = Counter()
+		self.file_bytes_read = Counter()
+		self.patches = []
+
+	def patch(self, owner, name, function):
+		self.patches += [(owner, name, owner.__dict__.get(name))]
+		setattr(owner, name, function)
+
+	def enable(self):
+		"""Start counting, in place of any profile that already is."""
+		# Imported here, so tools that only might profile don't pay for loading script.
+		import script
+		global current
+		if current:
+			current.disable()
+		current = self
+		self.patch_init(script)
+		self.patch_to_asm(script)
+		self.patch_setup(script)
+		self.patch_open()
+
+	def disable(self):
+		global current
+		for owner, name, original in reversed(self.patches):
+			if original is None:
+				delattr(owner, name)
+			else:
+				setattr(owner, name, original)
+		self.patches = []
+		if current is self:
+			current = None
+
+	def patch_init(self, script):
+		# Object.__init__ does the parsing, and nothing overrides it.
+		init = script.Object.__init__.im_func
+		children = []
+		def timed_init(chunk, *args, **kwargs):
+			name = chunk.__class__.__name__
+			children.append(0.)
+			start = time.time()
+			try:
+				init(chunk, *args, **kwargs)
+			finally:
+				seconds = time.time() - start
+				self.constructions[name] += 1
+				self.parse_seconds[name] += seconds
+				self.parse_self_seconds[name] += seconds - children.pop()
+				if children:
+					children[-1] += seconds
+		self.patch(script.Object, '__init__', timed_init)
+
+	def patch_to_asm(self, script):
+		rendering = []
+		def counted(to_asm):
+			def counted_to_asm(chunk):
+				# A subclass calling its base's to_asm is still one render.
+				if rendering and rendering[-1] is chunk:
+					return to_asm(chunk)
+				self.renders[chunk.__class__.__name__] += 1
+				rendering.append(chunk)
+				try:
+					return to_asm(chunk)
+				finally:
+					rendering.pop()
+			return counted_to_asm
+		for class_ in set(get_chunk_classes(script.Chunk)):
+			if 'to_asm' in class_.__dict__:
+				self.patch(class_, 'to_asm', counted(class_.__dict__['to_asm']))
+
+	def patch_setup(self, script):
+		setup_version = script.setup_version
+		def counted_setup_version(version):
+			setup_version(version)
+			version['baserom'] = CountingRom(version['baserom'], self)
+			version['labels'] = CountingLabels(version['labels'], self)
+		self.patch(script, 'setup_version', counted_setup_version)
+		reload_labels = script.Session.__dict__['reload_labels']
+		def counted_reload_labels(session):
+			reload_labels(session)
+			session.version['labels'] = CountingLabels(session.version['labels'], self)
+		self.patch(script.Session, 'reload_labels', counted_reload_labels)
+
+	def patch_open(self):
+		open_ = __builtin__.open
+		def counted_open(filename, mode='r', *args):
+			self.file_opens[filename, mode] += 1
+			if 'r' in mode and os.path.isfile(filename):
+				self.file_bytes_read[filename] += os.path.getsize(filename)
+			return open_(filename, mode, *args)
+		self.patch(__builtin__, 'open', counted_open)
+
+	def to_dict(self):
+		return {
+			'classes': {
+				name: {
+					'constructions': count,
+					'parse_seconds': self.parse_seconds[name],
+					'parse_self_seconds': self.parse_self_seconds[name],
+					'renders': self.renders[name],
+				}
+				for name, count in self.constructions.items()
+			},
+			'renders': dict(self.renders),
+			'rom_bytes': self.rom_bytes,
+			'label_lookups': self.label_lookups,
+			'label_hits': self.label_hits,
+			'files': [
+				{'path': path, 'mode': mode, 'opens': count, 'bytes_read': self.file_bytes_read[path] if 'r' in mode else 0}
+				for (path, mode), count in sorted(self.file_opens.items())
+			],
+		}
+
+	def report(self, limit=30):
+		lines = ['{:<32} {:>9} {:>9} {:>9} {:>9}'.format('class', 'parses', 'total s', 'self s', 'renders')]
+		classes = set(self.constructions) | set(self.renders)
+		for name in sorted(classes, key=lambda name: -self.parse_self_seconds[name])[:limit]:
+			lines += ['{:<32} {:>9} {:>9.3f} {:>9.3f} {:>9}'.format(
+				name[:32], self.constructions[name], self.parse_seconds[name],
+				self.parse_self_seconds[name], self.renders[name],
+			)]
+		lines += [
+			'',
+			'rom bytes read: {}'.format(self.rom_bytes),
+			'label lookups: {} ({} found)'.format(self.label_lookups, self.label_hits),
+			'',
+		]
+		for (path, mode), count in self.file_opens.most_common(limit):
+			lines += ['{} ({}): {} opens{}'.format(
+				path, mode, count,
+				', {} bytes read'.format(self.file_bytes_read[path]) if 'r' in mode else '',
+			)]
+		return '\n'.join(lines)
+
+
+def add_profile_arguments(ap):
+	ap.add_argument('--profile', action='store_true', help='count parses, renders, rom reads and files, and report them on stderr')
+	ap.add_argument('--profile-json', metavar='FILE', help='write the profile to FILE as json')
+
+def start_profile(args):
+	"""Enable a profile if args asked for one, and report it at exit."""
+	if not (args.profile or args.profile_json):
+		return None
+	profile = Profile()
+	profile.enable()
+	def finish():
+		profile.disable()
+		if args.profile:
+			sys.stderr.write(profile.report() + '\n')
+		if args.profile_json:
+			with open(args.profile_json, 'w') as out:
+				json.dump(profile.to_dict(), out, indent=1, sort_keys=True)
+	atexit.register(finish)
+	return profile
@@ -0,0 +1,136 @@
+"""
+Progress events for long pipelines.
+
+A pipeline runs as named stages. Each stage reports items (and optionally
+bytes) as it goes, and when it ends, how long it took and its throughput.
+On a terminal that's a live status line; anywhere else it's one json object
+per event, so runs can be logged and their stage timings compared later.
+
+	progress = Progress()
+	with progress.stage('insert', total=len(paths)) as stage:
+		for path in paths:
+			insert_chunks(chunks, path, version)
+			stage.advance(bytes=os.path.getsize(path), detail=path)
+"""
+
+import json
+import sys
+import time
+
+
+class Stage(object):
+	def __init__(self, progress, name, total=None, unit='items'):
+		self.progress = progress
+		self.name = name
+		self.total = total
+		self.unit = unit
+		self.items = 0
+		self.bytes = 0
+		self.start = time.time()
+		self.last_update = 0
+
+	@property
+	def seconds(self):
+		return time.time() - self.start
+
+	def get_event(self, event, **extra):
+		item = {
+			'event': event,
+			'stage': self.name,
+			'unit': self.unit,
+			'items': self.items,
+			'total': self.total,
+			'bytes': self.bytes,
+			'seconds': round(self.seconds, 4),
+		}
+		item.update(extra)
+		return item
+
+	def advance(self, items=1, bytes=0, detail=None):
+		self.items += items
+		self.bytes += bytes
+		self.progress.emit(self.get_event('progress', detail=detail))
+
+	def __enter__(self):
+		self.progress.emit(self.get_event('start'))
+		return self
+
+	def __exit__(self, type_, value, traceback):
+		seconds = self.seconds
+		rates = {
+			'items_per_second': self.items / seconds if seconds else None,
+			'bytes_per_second': self.bytes / seconds if seconds else None,
+		}
+		if type_ is not None:
+			rates['error'] = '{}: {}'.format(type_.__name__, value)
+		self.progress.emit(self.get_event('end', **rates))
+		self.progress.stages += [(self.name, seconds)]
+		return False
+
+
+class Progress(object):
+	"""
+	mode is 'tty' for a status line, 'json' for json lines, or 'auto' to
+	pick by whether out is a terminal. With no out, nothing is written.
+	Either way, progress within a stage is written at most every interval
+	seconds; stage starts and ends always are.
+	"""
+	interval = 0.1
+
+	def __init__(self, out=sys.stderr, mode='auto'):
+		self.out = out
+		if mode == 'auto':
+			mode = 'tty' if out and hasattr(out, 'isatty') and out.isatty() else 'json'
+		self.mode = mode
+		self.stages = []
+		self.last_line = 0
+
+	def stage(self, name, total=None, unit='items'):
+		return Stage(self, name, total, unit)
+
+	def emit(self, event):
+		if not self.out:
+			return
+		now = time.time()
+		if event['event'] == 'progress' and now - self.last_line < self.interval:
+			return
+		self.last_line = now
+		if self.mode == 'json':
+			event = dict(event, time=now)
+			self.out.write(json.dumps(event, sort_keys=True) + '\n')
+		else:
+			self.write_status(event)
+		self.out.flush()
+
+	def write_status(self, event):
+		count = '{}/{}'.format(event['items'], event['total']) if event['total'] is not None else str(event['items'])
+		line = '[{}] {} {} {:.1f}s'.format(event['stage'], count, event['unit'], event['seconds'])
+		if event['bytes']:
+			line += ' {:.1f} kB'.format(event['bytes'] / 1024.)
+		if event['event'] == 'progress' and event.get('detail'):
+			line += ' ' + str(event['detail'])
+		if event['event'] == 'end':
+			if event.get('items_per_second'):
+				line += ' ({:.1f} {}/s)'.format(event['items_per_second'], event['unit'])
+			if event.get('error'):
+				line += ' failed: ' + event['error']
+			self.out.write('\r\x1b[K' + line + '\n')
+		else:
+			self.out.write('\r\x1b[K' + line)
+
+	def summary(self):
+		return '\n'.join('{}: {:.2f}s'.format(name, seconds) for name, seconds in self.stages)
+
+quiet = Progress(out=None)
+
+progress_argument = ('--progress', {
+	'choices': ['auto', 'tty', 'json', 'none'],
+	'default': 'auto',
+	'help': 'how to show progress on stderr (default: a status line on a terminal, json lines otherwise)',
+})
+
+def get_progress(mode='auto'):
+	"""A Progress for a --progress option."""
+	if mode == 'none':
+		return quiet
+	return Progress(sys.stderr, mode)
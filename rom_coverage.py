@@ -0,0 +1,160 @@
+"""
+Track which rom bytes have been claimed by decoded chunks.
+
+Claims are kept twice: as a byte map (one byte per rom byte, for fast counts
+over a range) and as a sorted list of non-overlapping intervals (for bisect
+lookups). A chunk that overlaps an earlier claim doesn't get any bytes; it is
+recorded in overlaps instead, the same way print_chunks comments it out.
+"""
+
+from bisect import bisect_left, bisect_right
+
+from incbins import IncbinIndex
+
+
+class Coverage(object):
+	def __init__(self, size):
+		self.size = size
+		# One byte per rom byte, 1 where claimed. Not packed, so bytearray.count and find work on it directly.
+		self.claimed = bytearray(size)
+		self.starts = []
+		self.intervals = []
+		self.points = []
+		self.overlaps = []
+
+	def add_chunks(self, chunks):
+		return self.add_all((chunk.address, chunk.last_address, chunk) for chunk in chunks)
+
+	def add(self, start, end, owner=None):
+		"""Claim start..end for owner. Returns False if it overlaps an earlier claim."""
+		return self.add_all([(start, end, owner)])[0]
+
+	def add_all(self, claims):
+		"""
+		Claim each (start, end, owner) in turn, and return whether each was claimed.
+		The sorted lists are only merged once at the end, so adding n claims doesn't insert into them n times.
+		"""
+		results = []
+		new = []
+		points = []
+		for start, end, owner in claims:
+			if end > start and self.claimed.find('\x01', start, end) != -1:
+				others = self.find(start, end) + [
+					interval for interval in new
+					if interval[0] < end and interval[1] > start
+				]
+				self.overlaps += [(start, end, owner, sorted(others, key=lambda interval: interval[0]))]
+				points += [start]
+				results += [False]
+			elif end <= start:
+				points += [start]
+				results += [True]
+			else:
+				new += [(start, end, owner)]
+				self.claimed[start:end] = '\x01' * (end - start)
+				results += [True]
+		if new:
+			self.intervals = sorted(self.intervals + new, key=lambda interval: interval[0])
+			self.starts = [interval[0] for interval in self.intervals]
+		if points:
+			self.points = sorted(set(self.points).union(points))
+		return results
+
+	def find(self, start, end):
+		"""Claimed intervals that overlap start..end."""
+		i = max(bisect_right(self.starts, start) - 1, 0)
+		found = []
+		for j in xrange(i, len(self.intervals)):
+			interval = self.intervals[j]
+			if interval[0] >= end:
+				break
+			if interval[1] > start:
+				found += [interval]
+		return found
+
+	def owner(self, address):
+		"""The owner of the claim that contains address, or None."""
+		i = bisect_right(self.starts, address) - 1
+		if i >= 0:
+			start, end, owner = self.intervals[i]
+			if address < end:
+				return owner
+		return None
+
+	def touches(self, start, end):
+		"""Whether anything, including zero-length chunks like labels, lies within start..end."""
+		i = bisect_left(self.points, start)
+		if i < len(self.points) and self.points[i] < end:
+			return True
+		return bool(self.find(start, end))
+
+	def claimed_bytes(self, start=0, end=None):
+		if end is None:
+			end = self.size
+		return self.claimed.count('\x01', start, end)
+
+	def gaps(self, min_size=0, start=0, end=None):
+		"""Unclaimed spans of at least min_size bytes, as (start, end)."""
+		if end is None:
+			end = self.size
+		gaps = []
+		previous = start
+		for interval in self.find(start, end) + [(end, end, None)]:
+			if interval[0] - previous >= max(min_size, 1):
+				gaps += [(previous, interval[0])]
+			previous = max(previous, interval[1])
+		return gaps
+
+
+def read_baserom_incbins(filename, baserom_path, index=None):
+	"""Yield (path, start, end) for every baserom incbin in filename and its includes."""
+	if index is None:
+		index = IncbinIndex([filename], baserom_path)
+	for path, i, start, end in index.incbins([filename]):
+		if end is not None:
+			yield path, start, end
+
+def get_progress(coverage, version, index=None):
+	"""
+	For each project file with baserom incbins left in it:
+	(path, bytes still in incbins, how many of those are claimed by decoded chunks)
+	"""
+	if index is None:
+		index = IncbinIndex(version['maps_paths'], version['baserom_path'])
+	totals = {}
+	for path in version['maps_paths']:
+		for filename, start, end in read_baserom_incbins(path, version['baserom_path'], index):
+			total, claimed = totals.get(filename, (0, 0))
+			totals[filename] = (total + end - start, claimed + coverage.claimed_bytes(start, end))
+	return [(filename, total, claimed) for filename, (total, claimed) in sorted(totals.items())]
+
+def print_progress(progress):
+	lines = []
+	for filename, total, claimed in progress:
+		percent = 100. * claimed / total if total else 100.
+		lines += ['{}: 0x{:x} bytes in incbins, 0x{:x} decoded ({:.1f}%)'.format(filename, total, claimed, percent)]
+	return '\n'.join(lines)
+
+
+def main():
+	from script import Session, get_args, get_classes
+	args = get_args(
+		'classname',
+		'address',
+		('version', {'nargs': '?', 'default': 'ruby'}),
+		('--gaps', {'type': lambda x: int(x, 0), 'default': None, 'help': 'list gaps of at least this many bytes'}),
+	)
+	session = Session(args.version)
+	class_ = get_classes()[args.classname]
+	session.parse(class_, int(args.address, 16))
+	coverage = session.coverage
+	print print_progress(get_progress(coverage, session.version, session.incbins))
+	for start, end, owner, others in coverage.overlaps:
+		print 'overlap: {!r} (0x{:x}-0x{:x}) with {}'.format(owner, start, end, ', '.join(repr(other[2]) for other in others))
+	if args.gaps is not None and coverage.intervals:
+		first, last = coverage.intervals[0][0], coverage.intervals[-1][1]
+		for start, end in coverage.gaps(args.gaps, first, last):
+			print 'gap: 0x{:x}-0x{:x} (0x{:x} bytes)'.format(start, end, end - start)
+
+if __name__ == '__main__':
+	main()
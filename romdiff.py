@@ -0,0 +1,126 @@
+"""
+Where a built rom differs from the baserom, by label and source file.
+
+Both images are memory mapped and compared as arrays, so even a 32 MB rom
+takes a fraction of a second. Each run of differing bytes is given the label
+it falls under, from the labels in the version's sources, and runs are listed
+by the file that label is in.
+
+	$ python pret-agb/romdiff.py
+	$ python pret-agb/romdiff.py pokeruby.gba baserom.gba --merge 16
+"""
+
+from collections import OrderedDict
+import mmap
+
+import numpy as np
+
+from constants import iter_labels
+import profiling
+import versions
+
+
+def map_rom(path):
+	"""A read only array view of the file at path."""
+	with open(path, 'rb') as f:
+		if not f.read(1):
+			return np.zeros(0, dtype=np.uint8)
+		return np.frombuffer(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ), dtype=np.uint8)
+
+def diff_runs(a, b, merge=0):
+	"""
+	(start, end) for each run of bytes that differ between a and b.
+	Runs less than merge bytes apart are joined. If one is longer,
+	the part past the end of the other is a run too.
+	"""
+	size = min(len(a), len(b))
+	differs = a[:size] != b[:size]
+	edges = np.diff(np.concatenate([[0], differs.view(np.int8), [0]]))
+	starts = np.flatnonzero(edges == 1)
+	ends = np.flatnonzero(edges == -1)
+	if len(a) != len(b):
+		if len(ends) and ends[-1] == size:
+			ends[-1] = max(len(a), len(b))
+		else:
+			starts = np.append(starts, size)
+			ends = np.append(ends, max(len(a), len(b)))
+	if merge and len(starts) > 1:
+		keep = np.concatenate([[True], starts[1:] - ends[:-1] >= merge])
+		starts = starts[keep]
+		ends = np.concatenate([ends[np.flatnonzero(keep)[1:] - 1], ends[-1:]])
+	return zip(starts.tolist(), ends.tolist())
+
+
+class LabelIndex(object):
+	"""Labels in a version's sources, sorted by rom offset, with the file each is in."""
+	def __init__(self, paths):
+		labels = {}
+		for path in paths:
+			for address, label, source in iter_labels(path):
+				labels[address & 0x1ffffff] = (label, source)
+		self.addresses = np.array(sorted(labels), dtype=np.int64)
+		self.labels = [labels[address] for address in self.addresses]
+
+	def find(self, address):
+		"""(label, offset into it, source file) for the label at or before address."""
+		i = np.searchsorted(self.addresses, address, 'right') - 1
+		if i < 0:
+			return None, address, None
+		label, source = self.labels[i]
+		return label, address - int(self.addresses[i]), source
+
+
+def diff_roms(built_path, base_path, paths, merge=0):
+	"""
+	Runs where built_path differs from base_path, grouped by source file:
+	{source: [(start, end, label, offset)]}, in order of each file's first run.
+	"""
+	runs = diff_runs(map_rom(built_path), map_rom(base_path), merge)
+	index = LabelIndex(paths)
+	by_source = OrderedDict()
+	for start, end in runs:
+		label, offset, source = index.find(start)
+		by_source.setdefault(source, []).append((start, end, label, offset))
+	return by_source
+
+def print_diff(by_source, limit=20):
+	lines = []
+	for source, runs in by_source.items():
+		size = sum(end - start for start, end, label, offset in runs)
+		lines += ['{}: {} runs, 0x{:x} bytes'.format(source or '(no label)', len(runs), size)]
+		for start, end, label, offset in runs[:limit]:
+			where = '{}+0x{:x}'.format(label, offset) if label else ''
+			lines += ['\t0x{:x}-0x{:x} (0x{:x}) {}'.format(start, end, end - start, where)]
+		if len(runs) > limit:
+			lines += ['\t... {} more'.format(len(runs) - limit)]
+	if not by_source:
+		lines += ['identical']
+	return '\n'.join(lines)
+
+
+def main():
+	from argparse import ArgumentParser
+	import sys
+	ap = ArgumentParser()
+	ap.add_argument('built', nargs='?', help='the rom to check (default: the version\'s build)')
+	ap.add_argument('base', nargs='?', help='the rom to check against (default: the version\'s baserom)')
+	ap.add_argument('--version', default='ruby')
+	ap.add_argument('--merge', type=int, default=0, help='join runs that are less than this many bytes apart')
+	ap.add_argument('--limit', type=int, default=20, help='list at most this many runs per file')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	version = versions.__dict__[args.version]
+	by_source = diff_roms(
+		args.built or version['build_path'],
+		args.base or version['baserom_path'],
+		version['maps_paths'],
+		args.merge,
+	)
+	print print_diff(by_source, args.limit)
+	if by_source:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
@@ -0,0 +1,130 @@
+"""
+Check that parsed chunks reassemble to the rom, without building the project.
+
+Every chunk that would be emitted is turned back into bytes with to_bytes:
+values from their parsed values, commands and macros (msgbox, giveitem, switch)
+from the commands under them, strings through the charmap encoder, and files
+from the data they'd be written with. It all goes into one array, which is
+compared against the rom in one go.
+
+	$ python pret-agb/round_trip.py
+	$ python pret-agb/round_trip.py --root EventScript 1b6e63
+"""
+
+from collections import Counter
+import sys
+
+import numpy as np
+
+from script import *
+import profiling
+
+
+class RoundTrip(object):
+	"""
+	mismatches are (start, end, chunk, label) for each chunk whose bytes differ from
+	the rom, with the first and last address that differ. wrong_lengths are
+	(chunk, length) where a chunk's bytes aren't as long as the chunk,
+	errors are (chunk, message) where they couldn't be made at all,
+	and unknown counts, by class, chunks with no bytes to check.
+	"""
+	def __init__(self, chunks, rom):
+		self.mismatches = []
+		self.wrong_lengths = []
+		self.errors = []
+		self.unknown = Counter()
+		self.verified_bytes = 0
+		labels = sorted((chunk.address, chunk.asm) for chunk in chunks if isinstance(chunk, Label))
+		self.label_addresses = np.array([address for address, asm in labels], dtype=np.int64)
+		self.label_names = [asm for address, asm in labels]
+		self.check([chunk for chunk in chunks if not isinstance(chunk, Label)], rom)
+
+	def get_label(self, address):
+		i = np.searchsorted(self.label_addresses, address, 'right') - 1
+		if i < 0:
+			return None
+		offset = address - self.label_addresses[i]
+		return self.label_names[i] + ('+0x{:x}'.format(offset) if offset else '')
+
+	def check(self, chunks, rom):
+		checked = []
+		data = []
+		for chunk in chunks:
+			try:
+				chunk_data = chunk.to_bytes()
+			except Exception as e:
+				self.errors += [(chunk, '{}: {}'.format(e.__class__.__name__, e))]
+				continue
+			if chunk_data is None:
+				self.unknown[chunk.__class__.__name__] += 1
+				continue
+			if len(chunk_data) != chunk.length:
+				self.wrong_lengths += [(chunk, len(chunk_data))]
+			if chunk_data:
+				checked += [chunk]
+				data += [bytes(chunk_data)]
+		if not checked:
+			return
+
+		rom = np.frombuffer(bytes(rom), dtype=np.uint8)
+		lengths = np.array(map(len, data), dtype=np.int64)
+		starts = np.array([chunk.address for chunk in checked], dtype=np.int64)
+		offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+		owners = np.repeat(np.arange(len(checked)), lengths)
+		positions = np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+		data = np.frombuffer(''.join(data), dtype=np.uint8)
+
+		inside = positions < len(rom)
+		differs = ~inside
+		differs[inside] = rom[positions[inside]] != data[inside]
+		self.verified_bytes = int(np.count_nonzero(~differs))
+
+		bad = owners[differs]
+		bad_positions = positions[differs]
+		for owner in np.unique(bad):
+			where = bad_positions[bad == owner]
+			chunk = checked[owner]
+			start, end = int(where.min()), int(where.max()) + 1
+			self.mismatches += [(start, end, chunk, self.get_label(start))]
+		self.mismatches.sort(key=lambda item: item[0])
+
+	@property
+	def ok(self):
+		return not (self.mismatches or self.wrong_lengths or self.errors)
+
+	def report(self, limit=50):
+		lines = ['{} bytes match the rom'.format(self.verified_bytes)]
+		for start, end, chunk, label in self.mismatches[:limit]:
+			lines += ['mismatch: 0x{:x}-0x{:x} in {!r}{}'.format(start, end, chunk, ' at ' + label if label else '')]
+		for chunk, length in self.wrong_lengths[:limit]:
+			lines += ['wrong length: {!r} is 0x{:x} bytes, but makes 0x{:x}'.format(chunk, chunk.length, length)]
+		for chunk, message in self.errors[:limit]:
+			lines += ['error: {!r}: {}'.format(chunk, message)]
+		if self.unknown:
+			lines += ['not checked: ' + ', '.join('{} {}'.format(name, count) for name, count in self.unknown.most_common())]
+		return '\n'.join(lines)
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('version', nargs='?', default='ruby')
+	ap.add_argument('--root', nargs=2, action='append', default=[], metavar=('CLASS', 'ADDRESS'), help='check what parses from here (default: gMapGroups)')
+	ap.add_argument('--limit', type=int, default=50, help='list at most this many of each kind of problem')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	version = get_setup_version(args.version)
+	classes = get_classes()
+	roots = [(classes[name], int(address, 16)) for name, address in args.root]
+	if not roots:
+		roots = [(classes['MapGroups'], version['map_groups_address'])]
+	chunks = get_recursive_all(roots, version=version)
+	round_trip = RoundTrip(chunks, version['baserom'])
+	print round_trip.report(args.limit)
+	if not round_trip.ok:
+		sys.exit(1)
+
+if __name__ == '__main__':
+	main()
@@ -3,11 +3,17 @@
 """Classes for parsing Pokemon Emerald scripts.
 """
 
+import copy
+from multiprocessing.pool import ThreadPool
 import os
+import time
 
 from new import classobj
 
 from constants import *
+from incbins import IncbinIndex, scan_lines
+from progress import get_progress, progress_argument, quiet
+from rom_coverage import Coverage
 import versions
 
 
@@ -49,6 +55,17 @@ class Chunk(Object):
         self.last_address = self.address
     def to_asm(self):
         return None
+    def to_bytes(self):
+        """The bytes this chunk assembles to, or None if that isn't known."""
+        if not self.chunks:
+            return bytearray() if self.length == 0 else None
+        data = bytearray()
+        for chunk in self.chunks:
+            chunk_data = chunk.to_bytes()
+            if chunk_data is None:
+                return None
+            data += chunk_data
+        return data
     def __repr__(self):
         return self.__class__.__name__ + '(' + hex(self.address) + ')'
 
@@ -75,6 +92,12 @@ class Value(Param):
         self.value = sum(byte << (8 * i) for i, byte in enumerate(bytes_))
         self.last_address = self.address + self.num_bytes
 
+    def to_bytes(self):
+        data = bytearray((self.value >> (8 * i)) & 0xff for i in xrange(self.num_bytes))
+        if self.big_endian:
+            data.reverse()
+        return data
+
     def get_constants(self, constants=None):
         if constants is None:
             if hasattr(self, 'constants'):
@@ -259,11 +282,11 @@ class Label(Chunk):
     include_address = True
     address_comment = True
     is_global = False
-    counts = {}
     def count(self, base):
-        self.counts.setdefault(base, 0)
-        self.counts[base] += 1
-        return self.counts[base]
+        counts = self.version.setdefault('label_counts', {})
+        counts.setdefault(base, 0)
+        counts[base] += 1
+        return counts[base]
     def parse(self):
         Chunk.parse(self)
         if not hasattr(self, 'asm'):
@@ -275,6 +298,10 @@ class Label(Chunk):
                 #label += '_{}'.format(self.count(label))
                 label += '_{:X}'.format(self.address)
             self.asm = label
+            self.default_asm = label
+    @property
+    def generated(self):
+        return getattr(self, 'original_asm', self.asm) == getattr(self, 'default_asm', None)
     def to_asm(self):
         asm = self.asm
         if self.is_global:
@@ -385,19 +412,53 @@ class BinFile(Chunk):
 		return '"' + self.filename + '"'
 	def to_asm(self):
 		return '\t' + self.name + ' ' + self.asm
+	def to_bytes(self):
+		return bytearray(self.value)
+	def get_files(self):
+		"""(filename, data) for each file this chunk is built from."""
+		return [(self.filename, bytes(bytearray(self.value)))]
 	def create_file(self):
-		filename = self.filename
+		write_files(self.get_files(), workers=1)
+
+def write_file(filename, data):
+	"""Write data to filename unless it already holds exactly that. Returns whether it was written."""
+	if os.path.exists(filename) and os.path.getsize(filename) == len(data):
+		with open(filename, 'rb') as f:
+			if f.read() == data:
+				return False
+	with open(filename, 'wb') as out:
+		out.write(data)
+	return True
+
+def write_files(files, workers=8):
+	"""
+	Write (filename, data) pairs, creating each directory once.
+	Files that already hold the same data are left alone, so their mtimes
+	don't trigger rebuilds. Returns the filenames that were written.
+	"""
+	files = sorted(dict(files).items())
+	for directory in sorted(set(os.path.dirname(filename) for filename, data in files)):
+		if directory and not os.path.isdir(directory):
+			os.makedirs(directory)
+	if workers > 1 and len(files) > 1:
+		pool = ThreadPool(workers)
 		try:
-			os.makedirs(os.path.dirname(filename))
-		except OSError:
-			pass
-		with open(filename, 'wb') as out:
-			out.write(bytearray(self.value))
-
-def create_files_of_chunks(chunks):
+			written = pool.map(lambda item: write_file(*item), files)
+		finally:
+			pool.close()
+			pool.join()
+	else:
+		written = [write_file(*item) for item in files]
+	return [filename for (filename, data), was_written in zip(files, written) if was_written]
+
+def create_files_of_chunks(chunks, workers=8):
+	files = []
 	for chunk in chunks:
-		if hasattr(chunk, 'create_file'):
+		if hasattr(chunk, 'get_files'):
+			files += chunk.get_files()
+		elif hasattr(chunk, 'create_file'):
 			chunk.create_file()
+	return write_files(files, workers)
 
 
 class MapId(Macro):
@@ -430,7 +491,38 @@ class WarpMapId(MapId):
 
 
 def recursive_parse(*args, **kwargs):
-    chunks = {}
+    return recursive_parse_all([args], **kwargs)
+
+def is_parsed_as(chunk, class_):
+    """
+    Whether chunk was parsed as class_. Classes made by extend() are new subclasses
+    each time, so a chunk counts as class_ if any of its classes shares class_'s name.
+    """
+    return isinstance(chunk, class_) or any(c.__name__ == class_.__name__ for c in type(chunk).__mro__)
+
+def get_visited(visited, class_, address):
+    """
+    The chunk at address in visited, or None.
+    Raises ValueError if it was already parsed as something other than class_.
+    """
+    chunk = visited.get(address)
+    if chunk is not None and class_ is not None and not is_parsed_as(chunk, class_):
+        raise ValueError('0x{:x} was already parsed as {}, not {}'.format(address, type(chunk).__name__, class_.__name__))
+    return chunk
+
+def recursive_parse_all(roots, visited=None, tracer=None, new=None, **kwargs):
+    """
+    Parse each (class, address, ...) root in turn, sharing one visited map.
+    Subroutines reachable from more than one root are only parsed once.
+    Pass the returned dict back in as visited to keep adding roots to it.
+    If a tracer is given, its edge() is called for every pointer followed,
+    and its node() for every chunk once everything under it is parsed.
+    If new is given, each chunk parsed (rather than found in visited) is appended to it.
+    Raises ValueError if a root's address was already parsed as another class.
+    """
+    if visited is None:
+        visited = {}
+    chunks = visited
     closure = {
         'level': -1,
         'context_labels': [''],
@@ -443,17 +535,23 @@ def recursive_parse(*args, **kwargs):
         if address in (None, 0):
             return
         closure['level'] += 1
+        start = time.time()
         chunk = class_(address, *args_, **kwargs_)
+        parsed = time.time()
         chunks[address] = chunk
+        if new is not None:
+            new.append(chunk)
         context = hasattr(chunk, 'context_label')
         if context:
             closure['context_labels'] += [chunk.context_label]
-        recurse_pointers(chunk)
+        recurse_pointers(chunk, chunk)
         if context:
             closure['context_labels'].pop()
+        if tracer:
+            tracer.node(chunk, closure['level'], parsed - start, time.time() - start)
         closure['level'] -= 1
 
-    def recurse_pointers(chunk):
+    def recurse_pointers(chunk, owner):
         if hasattr(chunk, 'target') and chunk.target:
             if chunk.real_address:
                 if not hasattr(chunk, 'label') or not chunk.label:
@@ -472,11 +570,15 @@ def recursive_parse(*args, **kwargs):
 		target_args = {}
 		target_args.update(kwargs)
 		target_args.update(chunk.target_args)
+                if tracer:
+                    tracer.edge(owner, chunk, chunk.target_args, closure['level'], not chunks.get(chunk.real_address))
                 recurse(chunk.target, chunk.real_address, **target_args)
         for c in chunk.chunks:
-            recurse_pointers(c)
+            recurse_pointers(c, owner)
 
-    recurse(*args, **kwargs)
+    for root in roots:
+        get_visited(chunks, root[0], root[1])
+        recurse(*root, **kwargs)
     return chunks
 
 class Baserom(BinFile):
@@ -486,12 +588,24 @@ class Baserom(BinFile):
 	@property
 	def asm(self):
 		return '"{}", [redacted], 0x{:x}'.format(self.filename, self.size)
-	def create_file(self):
-		pass
+	def get_files(self):
+		return []
 
 def sort_chunks(chunks):
     return sorted(set((c.address, c.last_address, c.to_asm()) for c in chunks))
 
+class RenderedChunk(Chunk):
+    """A chunk that was rendered somewhere else. Only its asm is kept."""
+    arg_names = ['address', 'last_address', 'asm']
+    def parse(self):
+        self.chunks = []
+    def to_asm(self):
+        return self.asm
+
+def render_chunks(chunks):
+    """Chunks as they render now, so they can be printed or inserted later without rendering them again."""
+    return [RenderedChunk(*item) for item in sort_chunks(chunks)]
+
 def print_chunks(chunks):
     sorted_chunks = sort_chunks(chunks)
     lines = []
@@ -519,7 +633,14 @@ def incbin(path, start, end):
     #return Baserom(filename=path, address=start, size=end-start).to_asm()
     return '\t.incbin "{path}", 0x{start:x}, 0x{length:x}'.format(path=path, start=start, length=end - start)
 
-def insert_chunks(chunks, filename, version):
+def insert_chunks(chunks, filename, version, coverage=None, index=None, file_lock=None):
+    """
+    Replace baserom incbins in filename (and its includes) with chunks.
+    If coverage is given, incbins it has no claims in are skipped without looking at the chunks.
+    If index (an IncbinIndex) is given, files are read from it, includes with no incbins left are skipped,
+    and it's kept up to date with what's written.
+    If file_lock is given, file_lock(path) is held from reading each file to writing it back.
+    """
     baserom_path = version['baserom_path']
     closure = {}
     def next_chunk():
@@ -539,23 +660,35 @@ def insert_chunks(chunks, filename, version):
         return closure.get('previous_asm')
 
     def insert(filename):
-        if not os.path.exists(filename):
-            return
-        lines = open(filename).readlines()
+        if file_lock is None:
+            return insert_file(filename)
+        with file_lock(filename):
+            insert_file(filename)
+
+    def insert_file(filename):
+        if index is not None:
+            found = index.get_file(filename)
+            if found is None:
+                return
+            lines, entries = found
+            lines = list(lines)
+        else:
+            if not os.path.exists(filename):
+                return
+            lines = open(filename).readlines()
+            entries = scan_lines(lines, baserom_path)
         original_text = ''.join(lines)
-        for i, line in enumerate(lines):
-            if '.include' in line:
-                sub = line.split('"')[1]
-                insert(sub)
-            elif '.incbin "{path}"'.format(path=baserom_path) in line:
-                args = map(eval, line.split('@')[0].split(',')[1:3])
-                try:
-                    start, length = args
-                    end = start + length
-                except:
-                    start = args[0]
+        for kind, i, start, end in entries:
+            if kind == 'include':
+                if index is None or index.has_incbins(start):
+                    insert(start)
+            elif kind == 'incbin':
+                if end is None:
                     end = 0x1000000
 
+                if coverage is not None and not coverage.touches(start, end):
+                    continue
+
                 address, last_address, asm = current_chunk()
                 # sorry dead chunks
                 while address < start:
@@ -593,6 +726,8 @@ def insert_chunks(chunks, filename, version):
         if new_text != original_text:
             with open(filename, 'w') as out:
                 out.write(new_text)
+            if index is not None:
+                index.update(filename, new_text)
 
     sorted_chunks = iter(sort_chunks(chunks))
     next_chunk()
@@ -618,31 +753,212 @@ def flatten_nested_chunks(*args):
 def print_nested_chunks(*args):
     return print_chunks(flatten_nested_chunks(*args))
 
+def resolve_labels(chunks, version=None):
+    """
+    Give every labelled address exactly one name, and every name exactly one address.
+    Names already in the project's labels win over explicitly named labels,
+    which win over generated ones. A name claimed by two addresses gets the
+    address appended for all but the first.
+
+    Names are always chosen from what each label was originally called, so the
+    result only depends on chunks, even if some of them were resolved before
+    as part of a different set.
+    """
+    existing = {}
+    if version:
+        existing = version.get('labels', {})
+    by_address = {}
+    for chunk in chunks:
+        if isinstance(chunk, Label):
+            if not hasattr(chunk, 'original_asm'):
+                chunk.original_asm = chunk.asm
+                chunk.original_is_global = chunk.is_global
+            by_address.setdefault(chunk.address, []).append(chunk)
+    def rank(label):
+        if existing.get(0x8000000 + label.address) == label.original_asm:
+            return 0
+        if not label.generated:
+            return 1
+        return 2
+    names = {}
+    for address, labels in sorted(by_address.items()):
+        best = min(labels, key=lambda label: (rank(label), label.original_asm))
+        name = best.original_asm
+        if names.get(name, address) != address:
+            name += '_{:X}'.format(address)
+        names[name] = address
+        is_global = any(label.original_is_global for label in labels)
+        for label in labels:
+            label.asm = name
+            label.is_global = is_global
+    return chunks
+
 def get_setup_version(version_name='ruby'):
-    version = versions.__dict__[version_name]
+    """
+    Return a freshly set up copy of a version. The dicts in versions, and everything in them, are left untouched.
+    """
+    version = copy.deepcopy(versions.__dict__[version_name])
     setup_version(version)
     return version
 
 def get_recursive(class_, address, version_name='ruby', version=None):
+    return get_recursive_all([(class_, address)], version_name, version)
+
+def get_recursive_all(roots, version_name='ruby', version=None):
+    """
+    Like get_recursive, but for a list of (class, address) roots parsed
+    against one visited map, with label collisions resolved across all of them.
+    """
     if version is None:
         version = get_setup_version(version_name)
-    chunks = flatten_nested_chunks(recursive_parse(class_, address, version=version, rom=version['baserom']).values())
-    return chunks
+    chunks = flatten_nested_chunks(recursive_parse_all(roots, version=version, rom=version['baserom']).values())
+    return resolve_labels(chunks, version)
 
 def print_recursive(*args, **kwargs):
     return print_chunks(get_recursive(*args, **kwargs))
 
-def insert_recursive(class_, address, version_name='ruby', paths=None, version=None):
-    chunks = get_recursive(class_, address, version_name)
+def print_recursive_all(*args, **kwargs):
+    return print_chunks(get_recursive_all(*args, **kwargs))
+
+def insert_recursive(class_, address, version_name='ruby', paths=None, version=None, progress=quiet):
+    return insert_recursive_all([(class_, address)], version_name, paths, version, progress)
+
+def insert_recursive_all(roots, version_name='ruby', paths=None, version=None, progress=quiet):
+    """
+    Parse roots and insert them into paths, as 'parse' and 'insert' stages of progress.
+    """
     if version is None:
         version = get_setup_version(version_name)
+    with progress.stage('parse', total=len(roots), unit='roots') as stage:
+        chunks = get_recursive_all(roots, version_name, version)
+        stage.advance(len(roots), detail='{} chunks'.format(len(chunks)))
     if paths is None:
         paths = version['maps_paths']
-    for path in paths:
-        insert_chunks(chunks, path, version)
+    index = IncbinIndex(paths, version['baserom_path'])
+    with progress.stage('insert', total=len(paths), unit='files') as stage:
+        for path in paths:
+            insert_chunks(chunks, path, version, index=index)
+            stage.advance(bytes=os.path.getsize(path) if os.path.exists(path) else 0, detail=path)
+
+def get_reachable(visited, address):
+    """Chunks in visited that can be reached by following pointers from address."""
+    found = []
+    seen = set()
+    addresses = [address]
+    while addresses:
+        address = addresses.pop()
+        if address in seen:
+            continue
+        seen.add(address)
+        chunk = visited.get(address)
+        if chunk is None:
+            continue
+        found += [chunk]
+        nested = [chunk]
+        while nested:
+            c = nested.pop()
+            if getattr(c, 'target', None) and c.real_address:
+                addresses += [c.real_address]
+            nested += c.chunks
+    return found
+
+class Session(object):
+    """
+    Everything needed to disassemble one version: the rom, constants and labels,
+    plus every chunk parsed so far and the results of previous queries.
+
+    Sessions don't share any state, so one can be kept per version and reused
+    for as many queries as needed without reloading anything.
+    """
+    def __init__(self, version_name='ruby'):
+        self.version_name = version_name
+        self.version = get_setup_version(version_name)
+        self.visited = {}
+        self.cache = {}
+        self.resolved = None
+        self.coverage = Coverage(len(self.rom))
+        self.incbins = IncbinIndex(self.version['maps_paths'], self.version['baserom_path'])
+
+    @property
+    def rom(self):
+        return self.version['baserom']
+
+    @property
+    def labels(self):
+        return self.version['labels']
+
+    def reload_labels(self):
+        """Re-read labels from the project, e.g. after inserting chunks into it."""
+        self.version['labels'] = {}
+        for path in self.version['maps_paths']:
+            self.version['labels'].update(find_labels(path))
+        self.cache = {}
+        self.resolved = None
+
+    def parse(self, class_, address, *args):
+        """Parse into the shared visited map, and return the chunk at address."""
+        parsed = []
+        recursive_parse_all([(class_, address) + args], visited=self.visited, new=parsed, version=self.version, rom=self.rom)
+        self.coverage.add_chunks(sorted(parsed, key=lambda chunk: chunk.address))
+        return get_visited(self.visited, class_, address)
+
+    def reachable(self, address, class_=None):
+        """
+        Chunks in the visited map that can be reached by following pointers from address.
+        If class_ is given, the chunk at address must have been parsed as one.
+        """
+        get_visited(self.visited, class_, address)
+        return get_reachable(self.visited, address)
+
+    def get_recursive_all(self, roots):
+        roots = tuple(map(tuple, roots))
+        if roots not in self.cache:
+            for root in roots:
+                self.parse(*root)
+            found = {}
+            for root in roots:
+                for chunk in self.reachable(root[1], root[0]):
+                    found[chunk.address] = chunk
+            self.cache[roots] = flatten_nested_chunks(found.values())
+        # Queries share labels, so names are chosen again whenever another query was resolved since.
+        if self.resolved != roots:
+            resolve_labels(self.cache[roots], self.version)
+            self.resolved = roots
+        return self.cache[roots]
+
+    def get_recursive(self, class_, address):
+        return self.get_recursive_all([(class_, address)])
+
+    def print_recursive_all(self, roots):
+        return print_chunks(self.get_recursive_all(roots))
+
+    def print_recursive(self, class_, address):
+        return self.print_recursive_all([(class_, address)])
+
+    def insert_recursive_all(self, roots, paths=None):
+        chunks = self.get_recursive_all(roots)
+        if paths is None:
+            paths = self.version['maps_paths']
+        for path in paths:
+            insert_chunks(chunks, path, self.version, self.coverage, self.incbins)
+        self.reload_labels()
+
+    def insert_recursive(self, class_, address, paths=None):
+        self.insert_recursive_all([(class_, address)], paths)
+
+def get_classes():
+    """Every chunk class the command line entry points know about, by name."""
+    import misc
+    import battle_ai
+    import dump_graphics
+    classes = {}
+    for module in (dump_graphics, battle_ai, misc):
+        classes.update(vars(module))
+    return classes
 
 def get_args(*args):
     import argparse
+    import profiling
     ap = argparse.ArgumentParser()
     for arg in args:
         try:
@@ -650,7 +966,10 @@ def get_args(*args):
         except:
             name, kw = arg, {}
         ap.add_argument(name, **kw)
-    return ap.parse_args()
+    profiling.add_profile_arguments(ap)
+    args = ap.parse_args()
+    profiling.start_profile(args)
+    return args
 
 def main():
     args = get_args(
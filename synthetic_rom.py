@@ -0,0 +1,420 @@
+"""
+Build a made-up rom, with the constants and .s files to go with it, that every
+tool here can run on without a real baserom or a pokeruby checkout.
+
+Scripts are random but valid: commands come from the same command tables the
+parsers use, and their pointers lead to more scripts, text, movement and lists
+that are made along the way (or shared with ones made earlier). Maps have
+headers, attributes, blockdata, tilesets, events, warps and connections, and
+sit at the version's gMapGroups. The tables in misc and battle_ai are filled
+at their usual addresses.
+
+The same seed and scale always give the same files.
+
+	$ mkdir /tmp/synthetic && cd /tmp/synthetic
+	$ python pret-agb/synthetic_rom.py --maps 64 --seed 1
+	$ python pret-agb/dump_maps.py
+"""
+
+import os
+import random
+import re
+import struct
+
+from dump_maps import *
+from battle_ai import *
+import charmap
+import compression
+import misc
+import profiling
+import versions
+
+
+def iter_params(param_classes):
+	for item in param_classes:
+		try:
+			name, class_ = item
+		except TypeError:
+			name, class_ = None, item
+		yield name, class_
+
+def pack(value, num_bytes):
+	return bytearray(struct.pack({1: '<B', 2: '<H', 4: '<I'}[num_bytes], value))
+
+def pack_pointer(address):
+	if not address:
+		return pack(0, 4)
+	return pack(0x8000000 + address, 4)
+
+def get_constant_name(name):
+	"""PetalburgCity -> PETALBURG_CITY"""
+	return re.sub('(?<=[a-z0-9])(?=[A-Z])', '_', name).upper()
+
+words = ['hello', 'there', 'route', 'trainer', 'battle', 'berry', 'pokemon', 'the', 'a', 'is', 'go', 'town', 'wait']
+
+
+class RomFull(Exception):
+	pass
+
+class SyntheticRom(object):
+	"""
+	A rom that is filled in from the start, skipping over reserved tables.
+	Every piece of data remembers which .s file it belongs in.
+	"""
+	def __init__(self, version, seed=0, size=0x400000, share=0.3, depth=2, script_length=6):
+		self.version = version
+		self.rom = bytearray(size)
+		self.rng = random.Random(seed)
+		self.share = share
+		self.depth = depth
+		self.script_length = script_length
+		self.cursor = 0x200
+		self.reserved = []
+		self.blobs = []
+		self.path = None
+		self.pools = {}
+		self.usable = {}
+		self.encode = charmap.reverse_charmap(version['charmap'])
+
+	def put(self, address, data, path=None):
+		if address + len(data) > len(self.rom):
+			raise RomFull('0x{:x} bytes at 0x{:x} is past the end of the rom'.format(len(data), address))
+		self.rom[address:address + len(data)] = data
+		self.blobs += [(address, address + len(data), path or self.path)]
+		return address
+
+	def reserve(self, address, size, path):
+		self.reserved += [(address, address + size, path)]
+
+	def alloc(self, data, align=4):
+		address = self.cursor + (-self.cursor % align)
+		for start, end, path in sorted(self.reserved):
+			if address < end and address + len(data) > start:
+				address = end + (-end % align)
+		self.cursor = address + len(data)
+		return self.put(address, data)
+
+	def value(self, class_):
+		if issubclass(class_, Pointer):
+			return pack_pointer(self.target(class_.target))
+		if issubclass(class_, Value):
+			return pack(self.rng.randrange(0x80), class_.num_bytes)
+		return self.params(class_.param_classes)
+
+	def params(self, param_classes, **values):
+		data = bytearray()
+		for name, class_ in iter_params(param_classes):
+			if name in values:
+				value = values[name]
+				data += value if isinstance(value, bytearray) else pack(value, class_.num_bytes)
+			else:
+				data += self.value(class_)
+		return data
+
+	# What pointers can lead to. Anything else is left null.
+
+	def get_maker(self, class_):
+		"""(kind, maker, .s file) for class_."""
+		for base, maker, path in (
+			(EventScript, self.event_script, 'data/event_scripts.s'),
+			(Movement, self.movement, 'data/event_scripts.s'),
+			(Text, self.text, 'data/event_scripts.s'),
+			(BattleScript, self.battle_script, 'data/data1.s'),
+			(BattleTextList, self.battle_text_list, 'data/data1.s'),
+			(BattleAIScript, self.battle_ai_script, 'data/battle_ai_scripts.s'),
+			(TerminatedList, self.terminated_list, 'data/battle_ai_scripts.s'),
+		):
+			if issubclass(class_, base):
+				return base, maker, get_stub_path(self.version, path)
+		return None, None, None
+
+	def target(self, class_):
+		"""The address of a new or existing class_, or 0 if there's no way to make one."""
+		if class_ is None:
+			return 0
+		key, maker, path = self.get_maker(class_)
+		if maker is None:
+			return 0
+		pool = self.pools.setdefault(key, [])
+		if pool and (self.depth <= 0 or self.rng.random() < self.share):
+			return self.rng.choice(pool)
+		self.depth -= 1
+		outer_path, self.path = self.path, path
+		try:
+			address = maker(class_)
+		finally:
+			self.depth += 1
+			self.path = outer_path
+		pool += [address]
+		return address
+
+	def is_supported(self, class_):
+		if issubclass(class_, Pointer):
+			return class_.target is None or self.get_maker(class_.target)[1] is not None
+		if issubclass(class_, Value):
+			return True
+		if issubclass(class_, ParamGroup) and class_.parse.im_func is ParamGroup.parse.im_func:
+			return all(self.is_supported(param) for name, param in iter_params(class_.param_classes))
+		return False
+
+	def get_usable_commands(self, commands):
+		key = id(commands)
+		if key not in self.usable:
+			self.usable[key] = sorted(
+				(command for byte, command in commands.items()
+				if isinstance(byte, int)
+				and not getattr(command, 'end', False)
+				and all(self.is_supported(param) for name, param in iter_params(command.param_classes[1:]))),
+				key=lambda command: command.id
+			)
+		return self.usable[key]
+
+	def script(self, commands, ender):
+		data = bytearray()
+		usable = self.get_usable_commands(commands)
+		for i in xrange(self.rng.randint(1, self.script_length)):
+			command = self.rng.choice(usable)
+			data += chr(command.id) + self.params(command.param_classes[1:])
+		data += chr(commands[ender].id)
+		return self.alloc(data, align=1)
+
+	def event_script(self, class_=None):
+		return self.script(event_command_classes, 'end')
+
+	def battle_script(self, class_=None):
+		return self.script(battle_script_command_classes, 'end')
+
+	def battle_ai_script(self, class_=None):
+		return self.script(battle_ai_command_classes, 'end')
+
+	def movement(self, class_=None):
+		steps = [self.rng.randrange(len(movements)) for i in xrange(self.rng.randint(1, 8))]
+		return self.alloc(bytearray(steps) + bytearray([0xfe]), align=1)
+
+	def text(self, class_=None):
+		data = bytearray()
+		for i in xrange(self.rng.randint(2, 10)):
+			if data:
+				data += '\xfe' if self.rng.random() < 0.2 else self.encode[u' ']
+			word = self.rng.choice(words)
+			data += ''.join(self.encode[unicode(char)] for char in (word.capitalize() if i == 0 else word))
+		data += '\xff'
+		return self.alloc(data, align=1)
+
+	def battle_text_list(self, class_=None):
+		data = bytearray()
+		for i in xrange(self.rng.randint(1, 4)):
+			data += pack(self.rng.randrange(400), 2)
+		return self.alloc(data + pack(0xffff, 2), align=2)
+
+	def terminated_list(self, class_):
+		size = class_.param_classes[0].num_bytes
+		data = bytearray()
+		for i in xrange(self.rng.randint(1, 6)):
+			data += pack(self.rng.randrange(0x80), size)
+		return self.alloc(data + pack(class_.terminator, size), align=size)
+
+
+def build_maps(synthetic, num_maps, num_groups, num_tilesets, max_size=24):
+	"""Fill in gMapGroups and everything it leads to. Returns [[map name]] by group."""
+	version = synthetic.version
+	rng = synthetic.rng
+	names = version['map_names'][:num_maps]
+	per_group = -(-len(names) // num_groups)
+	groups = [names[i:i + per_group] for i in xrange(0, len(names), per_group)]
+	groups = [group for group in groups if group]
+	ids = {}
+	for group_num, group in enumerate(groups):
+		for num, name in enumerate(group):
+			ids[name] = (group_num, num)
+
+	synthetic.path = get_stub_path(version, 'data/graphics.s')
+	tilesets = []
+	for i in xrange(num_tilesets):
+		for class_ in (Tileset, Tileset2):
+			tiles = bytearray(rng.randrange(0x100) for j in xrange(0x20 * rng.randint(4, 16)))
+			image = synthetic.alloc(compression.compress_lz77(tiles))
+			palettes = synthetic.alloc(bytearray(rng.randrange(0x100) for j in xrange(TilesetPalettes.size)))
+			tilesets += [(class_, synthetic.alloc(
+				pack(1, 1) + pack(int(class_ is Tileset2), 1) + pack(0, 2)
+				+ pack_pointer(image) + pack_pointer(palettes) + pack(0, 4) * 3
+			))]
+	primaries = [address for class_, address in tilesets if class_ is Tileset]
+	secondaries = [address for class_, address in tilesets if class_ is Tileset2]
+
+	synthetic.path = get_stub_path(version, 'data/data2.s')
+	headers = {}
+	for name in names:
+		width, height = rng.randint(4, max_size), rng.randint(4, max_size)
+		blocks = bytearray()
+		for i in xrange(width * height):
+			blocks += pack(rng.randrange(0x400) | (rng.randrange(4) << 10) | (rng.randrange(16) << 12), 2)
+		border = synthetic.alloc(bytearray(rng.randrange(0x100) for i in xrange(MapBorder.size)))
+		blockdata = synthetic.alloc(blocks)
+		attributes = synthetic.alloc(
+			pack(width, 4) + pack(height, 4) + pack_pointer(border) + pack_pointer(blockdata)
+			+ pack_pointer(rng.choice(primaries)) + pack_pointer(rng.choice(secondaries))
+		)
+
+		def map_id(other, warp=False):
+			group, num = ids[other]
+			return pack(num, 1) + pack(group, 1) if warp else pack(group, 1) + pack(num, 1)
+
+		counts = [rng.randint(0, 4), rng.randint(0, 3), rng.randint(0, 2), rng.randint(0, 3)]
+		objects = bytearray()
+		for i in xrange(counts[0]):
+			objects += synthetic.params(MapObject.param_classes)
+		warps = bytearray()
+		for i in xrange(counts[1]):
+			warps += pack(rng.randrange(width), 2) + pack(rng.randrange(height), 2) + pack(0, 1) + pack(0, 1) + map_id(rng.choice(names), warp=True)
+		coord_events = bytearray()
+		for i in xrange(counts[2]):
+			coord_events += synthetic.params(MapCoordEvent.param_classes)
+		bg_events = bytearray()
+		for i in xrange(counts[3]):
+			# Kinds 5-8 are hidden items, the rest have scripts.
+			bg_events += pack(rng.randrange(width), 2) + pack(rng.randrange(height), 2) + pack(0, 1) + pack(0, 1) + pack(0, 2)
+			bg_events += pack_pointer(synthetic.target(EventScript))
+		events = synthetic.alloc(
+			bytearray(counts)
+			+ pack_pointer(objects and synthetic.alloc(objects))
+			+ pack_pointer(warps and synthetic.alloc(warps))
+			+ pack_pointer(coord_events and synthetic.alloc(coord_events))
+			+ pack_pointer(bg_events and synthetic.alloc(bg_events))
+		)
+
+		map_script_2 = synthetic.alloc(
+			pack(0x4050 + rng.randrange(0x10), 2) + pack(rng.randrange(4), 2) + pack_pointer(synthetic.target(EventScript)) + pack(0, 2)
+		)
+		map_scripts = synthetic.alloc(
+			pack(1, 1) + pack_pointer(synthetic.target(EventScript))
+			+ pack(2, 1) + pack_pointer(map_script_2)
+			+ pack(0, 1),
+			align=1,
+		)
+
+		connections = 0
+		others = [other for other in names if other != name]
+		if others:
+			num_connections = rng.randint(0, 2)
+			connection_list = bytearray()
+			for i in xrange(num_connections):
+				connection_list += pack(rng.randint(1, 4), 4) + pack(rng.randrange(-4, 5) & 0xffffffff, 4) + map_id(rng.choice(others)) + pack(0, 2)
+			if num_connections:
+				connections = synthetic.alloc(pack(num_connections, 4) + pack_pointer(synthetic.alloc(connection_list)))
+
+		headers[name] = synthetic.alloc(
+			pack_pointer(attributes) + pack_pointer(events) + pack_pointer(map_scripts) + pack_pointer(connections)
+			+ pack(rng.randrange(0x100), 2) + pack(0, 2) + pack(0, 4) + pack(0, 2) + pack(0, 2)
+		)
+
+	group_tables = [synthetic.alloc(bytearray().join(pack_pointer(headers[name]) for name in group)) for group in groups]
+	synthetic.put(version['map_groups_address'], bytearray().join(pack_pointer(address) for address in group_tables))
+	return groups
+
+def build_tables(synthetic):
+	"""Fill the fixed tables of script pointers that misc and battle_ai know about."""
+	version = synthetic.version
+	for table, path, target in (
+		(misc.StdScripts, 'data/event_scripts.s', EventScript),
+		(BattleAIs, 'data/battle_ai_scripts.s', BattleAIScript),
+		(misc.MoveEffects, 'data/data1.s', BattleScript),
+		(misc.gUnknown_081D9E48, 'data/data1.s', BattleScript),
+	):
+		synthetic.path = get_stub_path(version, path)
+		synthetic.put(table.address, bytearray().join(pack_pointer(synthetic.target(target)) for i in xrange(table.count)))
+
+def get_stub_path(version, path):
+	if path in version['maps_paths']:
+		return path
+	return version['maps_paths'][0]
+
+
+def get_stubs(synthetic):
+	"""{path: .s text} with an incbin for each run of data that belongs in path."""
+	runs = []
+	for start, end, path in sorted(synthetic.blobs):
+		if runs and runs[-1][2] == path and start - runs[-1][1] < 4:
+			runs[-1][1] = max(runs[-1][1], end)
+		else:
+			runs += [[start, end, path]]
+	baserom_path = synthetic.version['baserom_path']
+	stubs = {}
+	for start, end, path in runs:
+		stubs.setdefault(path, '')
+		stubs[path] += '\t.incbin "{}", 0x{:x}, 0x{:x}\n\n'.format(baserom_path, start, end - start)
+	return stubs
+
+def get_constants(version, groups, count=64):
+	"""{path: .s text} for the constants files setup_version reads."""
+	constants = {}
+	def enum(prefix, names):
+		return ''.join('\t.set {}_{}, {}\n'.format(prefix, name, i) for i, name in enumerate(names))
+	numbered = ['{:03}'.format(i) for i in xrange(count)]
+	constants['constants/species_constants.s'] = enum('SPECIES', numbered)
+	constants['constants/item_constants.s'] = enum('ITEM', numbered)
+	constants['constants/trainer_constants.s'] = enum('TRAINER', numbered)
+	constants['constants/move_constants.s'] = enum('MOVE', numbered)
+	constants['constants/battle_text.s'] = enum('STRINGID', numbered)
+	constants['constants/ability_constants.s'] = enum('ABILITY', numbered)
+	constants['constants/type_constants.s'] = enum('TYPE', numbered)
+	constants['constants/move_effects.s'] = enum('EFFECT', numbered)
+	constants['constants/hold_effects.s'] = enum('HOLD_EFFECT', numbered)
+	constants[version['field_object_constants_path']] = enum('MAP_OBJ_GFX', numbered)
+	map_constants = '\t.set cur_map_group, -1\n'
+	for group in groups:
+		map_constants += '\n\tnew_map_group\n'
+		for name in group:
+			map_constants += '\tmap_group {}\n'.format(get_constant_name(name))
+	constants['constants/map_constants.s'] = map_constants
+	return constants
+
+
+def build(version_name='ruby', seed=0, maps=32, groups=4, tilesets=4, size=0x400000, depth=2, share=0.3, script_length=6):
+	"""
+	Make a synthetic rom for version_name.
+	Returns (rom, {path: text}) for the rom's constants and .s files.
+	"""
+	version = dict(versions.__dict__[version_name])
+	maps = min(maps, len(version['map_names']))
+	synthetic = SyntheticRom(version, seed, size, share, depth, script_length)
+	synthetic.reserve(version['map_groups_address'], groups * 4, get_stub_path(version, 'data/data2.s'))
+	for table in (misc.StdScripts, BattleAIs, misc.MoveEffects, misc.gUnknown_081D9E48):
+		synthetic.reserve(table.address, table.count * 4, None)
+	build_tables(synthetic)
+	map_groups = build_maps(synthetic, maps, groups, tilesets)
+	files = {}
+	files.update(get_stubs(synthetic))
+	files.update(get_constants(version, map_groups))
+	return synthetic.rom, files
+
+def write(rom, files, version_name='ruby'):
+	version = versions.__dict__[version_name]
+	write_files(sorted(files.items()) + [(version['baserom_path'], bytes(rom))])
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('version', nargs='?', default='ruby')
+	ap.add_argument('--seed', type=int, default=0)
+	ap.add_argument('--maps', type=int, default=32)
+	ap.add_argument('--groups', type=int, default=4)
+	ap.add_argument('--tilesets', type=int, default=4, help='primary/secondary tileset pairs')
+	ap.add_argument('--depth', type=int, default=2, help='how deep pointers lead to new scripts before reusing old ones')
+	ap.add_argument('--share', type=float, default=0.3, help='chance that a pointer reuses an existing script')
+	ap.add_argument('--script-length', type=int, default=6, help='most commands in a script')
+	ap.add_argument('--size', type=lambda x: int(x, 0), default=0x400000)
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+	rom, files = build(
+		args.version, args.seed, args.maps, args.groups, args.tilesets,
+		args.size, args.depth, args.share, args.script_length,
+	)
+	write(rom, files, args.version)
+	for path in sorted(files):
+		print path
+
+if __name__ == '__main__':
+	main()
@@ -4,9 +4,17 @@ from script import *
 import charmap
 
 
+def get_encode_charmap(version, key='charmap'):
+    """The reverse of version[key], made once per version."""
+    encode_key = key + '_encode'
+    if encode_key not in version:
+        version[encode_key] = charmap.reverse_charmap(version[key])
+    return version[encode_key]
+
 class String(Chunk):
     name = '.string'
     atomic = True
+    charmap_key = 'charmap'
     def parse(self):
         Chunk.parse(self)
         address = self.address
@@ -16,8 +24,13 @@ class String(Chunk):
     def bytes(self):
         return self.rom[self.address:self.last_address]
     @property
+    def text(self):
+        return charmap.decode(self.bytes, self.version[self.charmap_key])
+    @property
     def asm(self):
-        return '"' + charmap.decode(self.bytes, self.version['charmap']) + '"'
+        return '"' + self.text + '"'
+    def to_bytes(self):
+        return bytearray(charmap.encode(self.text, get_encode_charmap(self.version, self.charmap_key)))
     def to_asm(self):
         newline = '"\n\t{} "'.format(self.name)
         asm = self.asm
@@ -33,9 +46,7 @@ class TextPointer(Pointer):
 
 
 class JPString(String):
-	@property
-	def asm(self):
-		return '"' + charmap.decode(self.bytes, self.version['charmap_jp']) + '"'
+	charmap_key = 'charmap_jp'
 
 class JPText(Text):
 	param_classes = [JPString]
@@ -50,6 +61,16 @@ class BrailleString(String):
     @property
     def asm(self):
         return '"' + strmap(self.mapping.get, self.bytes) + '"'
+    def to_bytes(self):
+        encode = {char: byte for byte, char in self.mapping.items()}
+        text = self.asm[1:-1]
+        data = bytearray()
+        i = 0
+        while i < len(text):
+            char = text[i:i + 2] if text[i] == '\\' else text[i]
+            data.append(encode[char])
+            i += len(char)
+        return data
 
 strmap = lambda *args: ''.join(map(*args))
 class RawString(String):
@@ -57,6 +78,8 @@ class RawString(String):
 	@property
 	def asm(self):
 		return '"' + strmap('{{0x{:02x}}}'.format, self.bytes) + '"'
+	def to_bytes(self):
+		return bytearray(charmap.encode(self.asm[1:-1], {}))
 
 class Braille(ParamGroup):
     param_classes = [Byte, Byte, Byte, Byte, Byte, Byte, ('string', BrailleString)]
@@ -68,11 +91,13 @@ class BraillePointer(Pointer):
 if __name__ == '__main__':
 	args = get_args(
 		'address',
-		('version', {'nargs': '?', 'default': 'ruby'})
+		('version', {'nargs': '?', 'default': 'ruby'}),
+		progress_argument,
 	)
 
 	insert_recursive(
 		Text,
 		int(args.address, 16),
 		args.version,
+		progress=get_progress(args.progress),
 	)
@@ -5,6 +5,7 @@ emerald = {
 	'version': 'emerald',
 	'map_groups_address': 0x486578,
 	'baserom_path': 'base_emerald.gba',
+	'build_path': 'pokeemerald.gba',
 	'maps_paths': ['asm/emerald.s'],
 	'force_stop_addresses': [
 		0x209a99, # SlateportCityBattleTent waitstate
@@ -21,6 +22,7 @@ ruby = {
 	'version': 'ruby',
 	'map_groups_address': 0x308588,
 	'baserom_path': 'baserom.gba',
+	'build_path': 'pokeruby.gba',
 	'maps_paths': [
 		'data/data1.s', 'data/data2.s', 'data/graphics.s', 'data/sound_data.s', 'asm/crt0.s', 'asm/rom1.s', 'asm/rom2.s', 'asm/rom3.s', 'asm/rom4.s', 'asm/rom5.s', 'asm/libgcnmultiboot.s', 'asm/m4a_1.s', 'asm/m4a_3.s', 'asm/libagbsyscall.s', 'asm/libc.s',
 		'data/event_scripts.s', 'data/battle_ai_scripts.s',
@@ -36,6 +38,7 @@ sapphire = {
 	'version': 'sapphire',
 	'map_groups_address': 0x308518,
 	'baserom_path': 'baserom_sapphire.gba',
+	'build_path': 'pokesapphire.gba',
 	'maps_paths': [
 		'data/data1.s', 'data/data2.s', 'data/graphics.s', 'data/sound_data.s', 'asm/crt0.s', 'asm/rom1.s', 'asm/rom2.s', 'asm/rom3.s', 'asm/rom4.s', 'asm/rom5.s', 'asm/libgcnmultiboot.s', 'asm/m4a_1.s', 'asm/m4a_3.s', 'asm/libagbsyscall.s', 'asm/libc.s',
 		'data/event_scripts.s', 'data/battle_ai_scripts.s',
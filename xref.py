@@ -0,0 +1,145 @@
+"""
+Who points at what, for the whole rom.
+
+Every aligned word that points into the rom is a raw reference. Pointers found
+by parsing are typed references, and replace the raw reference at the same
+address. References are kept sorted by target, so lookups are a binary search.
+
+The index is saved next to the project and reused as long as the rom matches.
+
+	$ python pret-agb/xref.py build --root EventScript 1b6e63
+	$ python pret-agb/xref.py refs 1b6e63
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+from script import *
+from pointer_scan import PointerScan
+import profiling
+
+raw_kind = 'raw'
+
+def get_default_path(version_name):
+	return '.pret-agb-xref.{}.npz'.format(version_name)
+
+def get_rom_digest(rom):
+	return hashlib.sha1(bytes(rom)).hexdigest()
+
+
+def iter_pointers(chunks):
+	"""(source, target, kind) for every pointer in chunks and their nested chunks."""
+	nested = list(chunks)
+	while nested:
+		chunk = nested.pop()
+		nested += chunk.chunks
+		if isinstance(chunk, Pointer) and is_rom_address(chunk.value):
+			kind = chunk.target.__name__ if chunk.target else chunk.__class__.__name__
+			yield chunk.address, chunk.real_address, kind
+
+
+class Xrefs(object):
+	def __init__(self, sources=(), targets=(), kinds=(), digest=None):
+		sources = np.asarray(sources, dtype=np.int64)
+		targets = np.asarray(targets, dtype=np.int64)
+		order = np.lexsort((sources, targets))
+		self.sources = sources[order]
+		self.targets = targets[order]
+		self.kinds = np.asarray(kinds, dtype=str)[order]
+		self.digest = digest
+
+	def __len__(self):
+		return len(self.targets)
+
+	@classmethod
+	def from_rom(cls, rom, chunks=()):
+		"""Raw references from a pointer scan of rom, overridden by the pointers in chunks."""
+		scan = PointerScan(rom)
+		raw_sources = np.flatnonzero(scan.is_pointer)
+		typed = {}
+		for source, target, kind in iter_pointers(chunks):
+			typed[source] = (target, kind)
+		raw = ~np.in1d(raw_sources * 4, typed.keys())
+		sources = list(raw_sources[raw] * 4) + typed.keys()
+		targets = list(scan.targets[raw_sources[raw]]) + [target for target, kind in typed.values()]
+		kinds = [raw_kind] * int(np.count_nonzero(raw)) + [kind for target, kind in typed.values()]
+		return cls(sources, targets, kinds, get_rom_digest(rom))
+
+	def find(self, start, end=None):
+		"""(source, target, kind) for every reference to start, or to anything in start..end."""
+		if end is None:
+			end = start + 1
+		i = np.searchsorted(self.targets, start, 'left')
+		j = np.searchsorted(self.targets, end, 'left')
+		return [
+			(int(self.sources[k]), int(self.targets[k]), str(self.kinds[k]))
+			for k in xrange(i, j)
+		]
+
+	def referenced(self, start, end=None):
+		"""Whether anything points at start, or into start..end."""
+		if end is None:
+			end = start + 1
+		return np.searchsorted(self.targets, start, 'left') < np.searchsorted(self.targets, end, 'left')
+
+	def save(self, path):
+		with open(path, 'wb') as out:
+			np.savez(out, sources=self.sources, targets=self.targets, kinds=self.kinds, digest=self.digest)
+
+	@classmethod
+	def load(cls, path):
+		data = np.load(path)
+		return cls(data['sources'], data['targets'], data['kinds'], str(data['digest']))
+
+
+def get_xrefs(session, roots=(), path=None, rebuild=False):
+	"""
+	Load the saved index for session's rom, or build and save it.
+	Roots are parsed first, so their pointers are typed in a new index.
+	"""
+	if path is None:
+		path = get_default_path(session.version_name)
+	if os.path.exists(path) and not roots and not rebuild:
+		xrefs = Xrefs.load(path)
+		if xrefs.digest == get_rom_digest(session.rom):
+			return xrefs
+	for root in roots:
+		session.parse(*root)
+	xrefs = Xrefs.from_rom(session.rom, session.visited.values())
+	xrefs.save(path)
+	return xrefs
+
+
+def main():
+	from argparse import ArgumentParser
+	ap = ArgumentParser()
+	ap.add_argument('--version', default='ruby')
+	ap.add_argument('--path')
+	ap.add_argument('--root', nargs=2, action='append', default=[], metavar=('CLASS', 'ADDRESS'), help='parse from here to find typed pointers')
+	ap.add_argument('command', choices=['build', 'refs'])
+	ap.add_argument('args', nargs='*')
+	profiling.add_profile_arguments(ap)
+	args = ap.parse_args()
+	profiling.start_profile(args)
+
+	session = Session(args.version)
+	classes = get_classes()
+	roots = [(classes[name], int(address, 16)) for name, address in args.root]
+
+	if args.command == 'build':
+		xrefs = get_xrefs(session, roots, args.path, rebuild=True)
+		print '{} references'.format(len(xrefs))
+	elif args.command == 'refs':
+		if len(args.args) not in (1, 2):
+			ap.error('refs takes an address, or a start and end address')
+		start = int(args.args[0], 16)
+		end = int(args.args[1], 16) if len(args.args) == 2 else None
+		xrefs = get_xrefs(session, roots, args.path)
+		for source, target, kind in xrefs.find(start, end):
+			label = session.labels.get(0x8000000 + target)
+			print '0x{:x} -> 0x{:x} {}{}'.format(source, target, kind, ' (' + label + ')' if label else '')
+
+if __name__ == '__main__':
+	main()